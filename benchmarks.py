@@ -0,0 +1,431 @@
+"""
+Microbenchmarks for the Nuvo serial protocol helpers
+
+Run from the Home Assistant configuration directory, i.e.
+    python -m custom_components.nuvo.benchmarks framer
+    python -m custom_components.nuvo.benchmarks parser --corpus frames.txt
+    python -m custom_components.nuvo.benchmarks nuvo --output before.json
+    python -m custom_components.nuvo.benchmarks replay nuvo-capture.jsonl --speed 10
+"""
+import argparse
+import collections
+import json
+import logging
+import platform
+import re
+import threading
+import time
+
+# Loads the Home Assistant components in an order media_player can import from
+import homeassistant.bootstrap  # noqa: F401
+
+try:
+    from . import protocol_nuvosim
+    from .media_player import (
+        ALL_ZONES_REPLY, AUTODETECT, BUSY_REPLY, CONCERTO_PATTERN, EOL, SOURCE_PATTERN,
+        ZOFF_PATTERN, ZON_PATTERN, PRIORITY_POLL, LineFramer, NuvoSourceCatalog,
+        NuvoStatusCoordinator, NuvoZone, SourceName, ZoneStatus, detect_profile, get_nuvo,
+        get_profile, parse_frame, read_capture, volumevaluetopercent)
+except ImportError:
+    import protocol_nuvosim
+    from media_player import (
+        ALL_ZONES_REPLY, AUTODETECT, BUSY_REPLY, CONCERTO_PATTERN, EOL, SOURCE_PATTERN,
+        ZOFF_PATTERN, ZON_PATTERN, PRIORITY_POLL, LineFramer, NuvoSourceCatalog,
+        NuvoStatusCoordinator, NuvoZone, SourceName, ZoneStatus, detect_profile, get_nuvo,
+        get_profile, parse_frame, read_capture, volumevaluetopercent)
+
+# Frames as received from Essentia and Grand Concerto amplifiers
+SAMPLE_FRAMES = [
+    b'#Z1,ON,SRC3,VOL42,DND0,LOCK0',
+    b'#Z12,OFF',
+    b'#Z7,ON,SRC1,VOLMUTE,DND0,LOCK1',
+    b'Z02PWRON,SRC2,VOL-35',
+    b'Z02STR+"TUNER"',
+    b'#Busy',
+    b'#?',
+]
+
+
+class _ReplayPort(object):
+    """
+    Minimal stand-in for serial.Serial that replays a byte stream
+    """
+
+    def __init__(self, data: bytes, chunk: int):
+        self._data = data
+        self._pos = 0
+        self._chunk = chunk
+
+    @property
+    def in_waiting(self):
+        # Bytes "arrive" in chunks, as they would from a USB-serial adapter
+        return min(self._chunk, len(self._data) - self._pos)
+
+    def read(self, size=1):
+        data = self._data[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+
+def _byte_loop(port, frames):
+    """
+    The read loop _listen_maybewait used before LineFramer
+    """
+    receive_buffer = b''
+    for _ in range(frames):
+        while True:
+            data = port.read(1)
+            receive_buffer += data
+            if EOL in receive_buffer:
+                message, sep, receive_buffer = receive_buffer.partition(EOL)
+                break
+
+
+def _framer_loop(port, frames):
+    framer = LineFramer()
+    for _ in range(frames):
+        while framer.pop() is None:
+            framer.feed(port.read(port.in_waiting or 1))
+
+
+def bench_framer(args):
+    stream = EOL.join(SAMPLE_FRAMES * (args.frames // len(SAMPLE_FRAMES))) + EOL
+    frames = stream.count(EOL)
+    for name, loop in (('byte loop', _byte_loop), ('LineFramer', _framer_loop)):
+        best = None
+        for _ in range(args.repeat):
+            port = _ReplayPort(stream, args.chunk)
+            start = time.perf_counter()
+            loop(port, frames)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print('{:<12} {:>8d} frames {:>9.2f} ms {:>10.0f} frames/s'.format(
+            name, frames, best * 1000, frames / best))
+
+
+def _legacy_parse(frame: bytes):
+    """
+    The decode + four pattern search parse used before parse_frame, without
+    its log calls
+    """
+    string = frame.decode('ascii').strip()
+    match = re.search(CONCERTO_PATTERN, string)
+    if match:
+        return ZoneStatus(match[1], match[2], None, None)
+    match = re.search(ZON_PATTERN, string)
+    if match:
+        groups = [str(m) for m in match.groups()]
+        if groups[3] == 'MUTE':
+            # The legacy parser raised ValueError on a muted zone
+            return None
+        return ZoneStatus(groups[0], groups[1], groups[2], volumevaluetopercent(groups[3]))
+    match = re.search(ZOFF_PATTERN, string)
+    if match:
+        groups = [str(m) for m in match.groups()]
+        return ZoneStatus(groups[0], groups[1], None, None)
+    match = re.search(SOURCE_PATTERN, string)
+    if match:
+        return match
+    return None
+
+
+def _load_corpus(path):
+    if path is None:
+        return SAMPLE_FRAMES
+    with open(path, 'rb') as corpus:
+        return [line.rstrip(b'\r\n') for line in corpus if line.strip()]
+
+
+def bench_parser(args):
+    corpus = _load_corpus(args.corpus)
+    frames = corpus * max(1, args.frames // len(corpus))
+    # Parse cost only, not the cost of formatting log records
+    logging.disable(logging.CRITICAL)
+    for name, parse in (('legacy', _legacy_parse), ('parse_frame', parse_frame)):
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            for frame in frames:
+                parse(frame)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print('{:<12} {:>8d} frames {:>9.2f} ms {:>10.0f} frames/s'.format(
+            name, len(frames), best * 1000, len(frames) / best))
+
+
+def _percentiles(samples):
+    """
+    :param samples: latencies in seconds
+    :return: dict of count and p50/p95/p99/max in milliseconds
+    """
+    samples = sorted(samples)
+    if not samples:
+        return {'count': 0}
+
+    def rank(q):
+        return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 3)
+
+    return {'count': len(samples), 'p50_ms': rank(0.50), 'p95_ms': rank(0.95),
+            'p99_ms': rank(0.99), 'max_ms': round(samples[-1] * 1000, 3)}
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def _commands(nuvo, zones, iterations):
+    """
+    One call per iteration of each command, cycling over the zones
+    """
+    samples = {'zone_status': [], 'set_volume': [], 'set_mute': [],
+               'set_source': [], 'set_power': []}
+    for i in range(iterations):
+        zone = zones[i % len(zones)]
+        samples['zone_status'].append(_timed(nuvo.zone_status, zone))
+        samples['set_volume'].append(_timed(nuvo.set_volume, zone, 20 + i % 60))
+        samples['set_mute'].append(_timed(nuvo.set_mute, zone, i % 2 == 0))
+        samples['set_source'].append(_timed(nuvo.set_source, zone, 1 + i % 6))
+        samples['set_power'].append(_timed(nuvo.set_power, zone, True))
+    return samples
+
+
+def _zone_count(nuvo, requested):
+    """
+    :param requested: --zones, None for every zone the amplifier has
+    :return: number of zones to exercise
+    """
+    amplifier = getattr(nuvo._port, 'amplifier', None)
+    if amplifier is None:
+        # A real port: nobody can tell how many zones answer
+        return requested or 20
+    available = len(amplifier.zones)
+    if requested is not None and requested > available:
+        # Absent zones only time out, the run would look hung
+        raise SystemExit('--zones {}: the emulated amplifier has {} zones'.format(
+            requested, available))
+    return requested or available
+
+
+def bench_nuvo(args):
+    logging.disable(logging.WARNING)
+    # No cache, every call measures a round trip on the wire
+    nuvo = get_nuvo(args.url, cache_ttl=0, capture=args.capture)
+    try:
+        zones = list(range(1, _zone_count(nuvo, args.zones) + 1))
+        commands = _commands(nuvo, zones, args.iterations)
+
+        sweeps = [_timed(nuvo.zone_statuses, zones) for _ in range(args.sweeps)]
+
+        # User commands while a poller sweeps every zone in the background
+        stop = threading.Event()
+        polls = []
+
+        def poll():
+            with nuvo.priority(PRIORITY_POLL):
+                while not stop.is_set():
+                    polls.append(_timed(nuvo.zone_statuses, zones))
+                    stop.wait(args.poll_interval)
+
+        poller = threading.Thread(target=poll, name='bench-poller', daemon=True)
+        poller.start()
+        try:
+            contended = _commands(nuvo, zones, args.iterations)
+        finally:
+            stop.set()
+            poller.join()
+        metrics = nuvo.metrics.as_dict()
+    finally:
+        nuvo.close()
+
+    results = {
+        'url': args.url,
+        'zones': len(zones),
+        'python': platform.python_version(),
+        'commands': {name: _percentiles(samples) for name, samples in commands.items()},
+        'sweep': dict(_percentiles(sweeps),
+                      zones_per_s=round(len(zones) * len(sweeps) / sum(sweeps), 1) if sweeps else None),
+        'contention': {
+            'poll_interval_s': args.poll_interval,
+            'polls': _percentiles(polls),
+            'commands': {name: _percentiles(samples) for name, samples in contended.items()},
+        },
+        'metrics': metrics,
+    }
+
+    for section, table in (('idle', results['commands']),
+                           ('polling', results['contention']['commands'])):
+        for name, stats in table.items():
+            print('{:<8} {:<12} p50 {:>8.2f} ms  p95 {:>8.2f} ms  p99 {:>8.2f} ms'.format(
+                section, name, stats['p50_ms'], stats['p95_ms'], stats['p99_ms']))
+    if sweeps:
+        print('sweep    {:>3d} zones  p50 {:>8.2f} ms  {:>8.1f} zones/s'.format(
+            len(zones), results['sweep']['p50_ms'], results['sweep']['zones_per_s']))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+
+class _ReplayHass(object):
+    """
+    Just enough of hass for a source catalog outside Home Assistant
+    """
+
+    def add_job(self, target, *args):
+        pass
+
+
+class _ReplayStore(object):
+    """
+    Store that keeps the source names a replay reads to itself
+    """
+
+    async def async_delay_save(self, data_func, delay=0):
+        pass
+
+
+class _ReplayZone(NuvoZone):
+    """
+    Zone entity that counts its state writes instead of making them
+    """
+    writes = 0
+
+    def schedule_update_ha_state(self, force_refresh=False):
+        self.writes += 1
+
+
+def _frame_kind(rtn):
+    if isinstance(rtn, ZoneStatus):
+        return 'status'
+    if isinstance(rtn, SourceName):
+        return 'source_name'
+    if rtn is BUSY_REPLY:
+        return 'busy'
+    if rtn is ALL_ZONES_REPLY:
+        return 'all_zones'
+    return 'unknown'
+
+
+def replay(args):
+    """
+    Feed the received frames of a capture through the profile parser, the
+    status coordinator and the zone entities, on the capture's clock scaled
+    by --speed or as fast as possible with --speed 0
+    """
+    header, frames = read_capture(args.capture)
+    profile = get_profile(args.model or header.get('model'))
+    zone_ids = list(range(1, 21))
+    coordinator = NuvoStatusCoordinator(None, zone_ids)
+    catalog = NuvoSourceCatalog(_ReplayHass(), _ReplayStore(), {}, None, header.get('port'), {})
+    zones = [_ReplayZone(None, coordinator, catalog, zone_id, 'Zone {}'.format(zone_id))
+             for zone_id in zone_ids]
+    for zone in zones:
+        coordinator.add_listener(zone.zone_id, zone._handle_coordinator_update)
+        catalog.add_listener(zone._handle_catalog_update)
+
+    kinds = collections.Counter()
+    parse, handle, lag, wire = [], [], [], []
+    # capture times of the requests still waiting for their response
+    unanswered = collections.deque()
+    start = time.perf_counter()
+    for at, direction, frame in frames:
+        if args.speed:
+            delay = start + at / args.speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            lag.append(max(0.0, -delay))
+        if direction == 'tx':
+            kinds['tx'] += 1
+            unanswered.append(at)
+            continue
+        frame = frame.strip()
+        began = time.perf_counter()
+        rtn = profile.parse(frame)
+        parsed = time.perf_counter()
+        if isinstance(rtn, ZoneStatus):
+            if profile is AUTODETECT:
+                profile = detect_profile(frame)
+            coordinator.handle_push(rtn)
+        elif isinstance(rtn, SourceName):
+            catalog.handle_name(rtn)
+        handle.append(time.perf_counter() - parsed)
+        parse.append(parsed - began)
+        kind = _frame_kind(rtn)
+        kinds[kind] += 1
+        # A reply pairs with the oldest request, frames nobody asked for stay unpaired
+        if kind != 'unknown' and unanswered:
+            wire.append(at - unanswered.popleft())
+    elapsed = time.perf_counter() - start
+
+    results = {
+        'capture': args.capture,
+        'model': profile.name,
+        'speed': args.speed,
+        'captured_dropped': header.get('dropped', 0),
+        'frames': dict(kinds),
+        'replay_s': round(elapsed, 3),
+        'captured_s': round(frames[-1][0] - frames[0][0], 3) if frames else 0,
+        'parse': _percentiles(parse),
+        'handle': _percentiles(handle),
+        'wire': _percentiles(wire),
+        'lag': _percentiles(lag),
+        'entity_writes': sum(zone.writes for zone in zones),
+    }
+
+    print('{} frames of {} ({} tx), replayed in {:.3f} s, {} entity writes'.format(
+        len(frames), profile.name, kinds['tx'], elapsed, results['entity_writes']))
+    for name in ('parse', 'handle', 'wire', 'lag'):
+        stats = results[name]
+        if stats['count']:
+            print('{:<8} p50 {:>8.3f} ms  p95 {:>8.3f} ms  p99 {:>8.3f} ms  max {:>8.3f} ms'.format(
+                name, stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['max_ms']))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    subparsers = parser.add_subparsers(dest='bench', required=True)
+
+    framer = subparsers.add_parser('framer', help='byte-at-a-time reads vs LineFramer')
+    framer.add_argument('--frames', type=int, default=20000)
+    framer.add_argument('--chunk', type=int, default=64,
+                        help='bytes reported by in_waiting per read')
+    framer.add_argument('--repeat', type=int, default=5)
+    framer.set_defaults(func=bench_framer)
+
+    parser_ = subparsers.add_parser('parser', help='legacy response parse vs parse_frame')
+    parser_.add_argument('--corpus', help='file of recorded frames, one per line')
+    parser_.add_argument('--frames', type=int, default=20000)
+    parser_.add_argument('--repeat', type=int, default=5)
+    parser_.set_defaults(func=bench_parser)
+
+    nuvo = subparsers.add_parser('nuvo', help='round trips, sweeps and contention against the emulator')
+    nuvo.add_argument('--url', default='nuvosim://essentia?zones=20&seed=1',
+                      help='port url, nuvosim:// paces bytes at the 57600 baud of get_nuvo')
+    nuvo.add_argument('--zones', type=int,
+                      help='zones to exercise, default every zone of the emulator or 20')
+    nuvo.add_argument('--iterations', type=int, default=200)
+    nuvo.add_argument('--sweeps', type=int, default=20)
+    nuvo.add_argument('--poll-interval', type=float, default=0.0,
+                      help='seconds between background sweeps')
+    nuvo.add_argument('--output', help='write the results as JSON to this file')
+    nuvo.add_argument('--capture', help='capture the serial traffic to this file')
+    nuvo.set_defaults(func=bench_nuvo)
+
+    replay_ = subparsers.add_parser('replay', help='replay a traffic capture through the parser and entities')
+    replay_.add_argument('capture', help='file written by TrafficCapture.dump')
+    replay_.add_argument('--speed', type=float, default=1.0,
+                         help='multiple of the captured speed, 0 replays as fast as possible')
+    replay_.add_argument('--model', help='profile to parse with instead of the captured one')
+    replay_.add_argument('--output', help='write the results as JSON to this file')
+    replay_.set_defaults(func=replay)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
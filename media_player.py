@@ -1,16 +1,29 @@
+import collections
 import functools
 import logging
+import queue
+import random
 import re
 import io
+import json
 import serial
 import string
 import time
 import asyncio
+import bisect
 import datetime
+from contextlib import asynccontextmanager, contextmanager
 from functools import wraps
-from threading import RLock
+from threading import Condition, Event, Lock, Thread, get_ident, local
+
+try:
+    import termios
+except ImportError:  # Windows
+    termios = None
 
 _LOGGER = logging.getLogger(__name__)
+# Hot-path trace logging is gated on this so it costs nothing unless debug is enabled
+_TRACE = functools.partial(_LOGGER.isEnabledFor, logging.DEBUG)
 #logging.basicConfig(format='%(asctime)s;%(levelname)s:%(message)s', level=logging.DEBUG)
 
 '''
@@ -38,67 +51,144 @@ SOURCE_PATTERN = re.compile('Z0(?P<zone>\d)'
                      'STR\+\"(?P<name>.*)\"')
 
 
+# Bytes patterns used by parse_frame, one per frame prefix, matched against
+# the whole frame so that a frame cut short by a lost byte is rejected
+_ESSENTIA_FRAME = re.compile(rb'#Z(?P<zone>\d{1,2}),'
+                             rb'(?P<power>ON|OFF)'
+                             rb'(?:,SRC(?P<source>\d),'
+                             rb'VOL(?P<volume>\d{1,2}|MUTE),'
+                             rb'DND(?P<dnd>1|0),'
+                             rb'LOCK(?P<keypadlock>1|0))?')
+
+_CONCERTO_FRAME = re.compile(rb'Z0(?P<zone>\d)'
+                             rb'(?:PWR(?P<power>ON|OFF),'
+                             rb'SRC(?P<source>\d),'
+                             rb'VOL(?P<volume>-\d\d|MT)'
+                             rb'|STR\+"(?P<name>.*)")')
+
+# Name reported for a source, i.e. Z02STR+"TUNER"
+SourceName = collections.namedtuple('SourceName', ['source', 'name'])
+
+def _source_key(source: int):
+    """Correlation key of a source name request, apart from the zone ids"""
+    return ('source', int(source))
+
 EOL = b'\r'
+BUSY = b'#Busy'
+# parse_frame result for a #Busy reply
+BUSY_REPLY = object()
+# Acknowledgement of an all-zone command, i.e. #ALLOFF
+ALL_ZONES = b'#ALL'
+# parse_frame result for it
+ALL_ZONES_REPLY = object()
 #TIMEOUT_OP       = 0.2   # Number of seconds before serial operation timeout
 TIMEOUT_OP       = 0.4   # Number of seconds before serial operation timeout
 TIMEOUT_RESPONSE = 2.5   # Number of seconds before command response timeout
+PIPELINE_DEPTH   = 4     # Number of requests sent ahead of their responses
+STATUS_CACHE_TTL = 2.0   # Number of seconds a received zone status is served from cache
+LINK_FAILURES    = 3     # Number of consecutive unanswered requests before the link is suspect
+LINK_STALL       = 10.0  # Number of seconds without a byte received before a suspect link is reopened
+RECONNECT_DELAY  = 0.5   # Number of seconds before the first attempt to reopen the port
+RECONNECT_MAX_DELAY = 30.0  # Upper bound of the backoff between attempts to reopen the port
+STARVATION_AGE   = 1.0   # Number of seconds a queued command waits before moving up one priority
+CAPTURE_FRAMES   = 10000 # Number of most recent frames a traffic capture keeps
+PACER_RATE       = 100.0 # Number of commands per second the pacer starts at
+PACER_MIN_RATE   = 5.0   # Floor of the paced command rate
+PACER_BACKOFF    = 0.5   # Fraction of the rate kept after a #Busy reply or a timeout
+PACER_RECOVERY   = 0.5   # Commands per second the rate regains with each answered command
+PACER_GAP_STEP   = 0.005 # Seconds the gap between commands widens by, at least, after a #Busy or timeout
+PACER_MAX_GAP    = 0.1   # Upper bound of the gap between commands
+PACER_HOLD       = 0.25  # Number of seconds after a cut in which further #Busy replies don't cut again
+CAPTURE_VERSION  = 1     # Format of the capture files
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS  = (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.5)
+RECONNECT_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
 VOLUME_DEFAULT  = 0.40    # Value used when zone is muted or otherwise unable to get volume integer
 
+# Errors of a port that went away: pyserial wraps most of them, but on POSIX
+# in_waiting is a bare ioctl (OSError) and flush a tcdrain (termios.error)
+PORT_ERRORS = (serial.SerialException, OSError) + ((termios.error,) if termios else ())
+
+# Priorities of the port lock, lowest goes first
+PRIORITY_INTERACTIVE = 0   # user commands
+PRIORITY_BULK        = 1   # snapshot and restore
+PRIORITY_POLL        = 2   # background status sweeps
+PRIORITY_NAMES = ('interactive', 'bulk', 'poll')
+
 class ZoneStatus(object):
+    """
+    Immutable status of one zone, compared field by field
+    """
+
+    __slots__ = ('zone', 'power', 'source', 'sourcename', 'volume', 'mute', 'treble', 'bass')
+
     def __init__(self
                  ,zone: int
                  ,power: str
                  ,source: int
                  ,volume: float  # -78 -> 0
                  ):
-        _LOGGER.warning("ZoneStatus init for Zone" + str(zone))
-        self.zone = zone
-        if 'ON' in power:
-           self.power = bool(1)
-        else:
-           self.power = bool(0)
-        self.source = str(source)
-        self.sourcename = ''
-#        self.treble = treble
-#        self.bass = bass
-        _LOGGER.warning("volume == None is " + str(volume == None))
-        _LOGGER.warning("volume is " + str(volume))
-        if volume == None:
-            _LOGGER.warning("setting vol/mute to defaults")
-            self.mute = bool(1)
-            self.volume = VOLUME_DEFAULT
+        setattr_ = object.__setattr__
+        setattr_(self, 'zone', zone)
+        setattr_(self, 'power', 'ON' in power)
+        setattr_(self, 'source', str(source))
+        setattr_(self, 'sourcename', '')
+        if volume is None:
+            setattr_(self, 'mute', True)
+            setattr_(self, 'volume', VOLUME_DEFAULT)
+        elif volume == 0:
+            setattr_(self, 'mute', True)
+            setattr_(self, 'volume', 0)
         else:
-            if volume == 0:
-                _LOGGER.warning("setting mute to 1 and volume to 0")
-                self.mute = bool(1)
-                self.volume = 0
-            else:
-                _LOGGER.warning("setting mute to 0 and volume to " + str(volume))
-                self.mute = bool(0)
-                self.volume = volume
-        self.treble = 0 
-        self.bass = 0
-        _LOGGER.warning("leaving ZoneStatus Init for zone " + str(zone))
+            setattr_(self, 'mute', False)
+            setattr_(self, 'volume', volume)
+        setattr_(self, 'treble', 0)
+        setattr_(self, 'bass', 0)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('ZoneStatus is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('ZoneStatus is immutable')
+
+    def _values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if not isinstance(other, ZoneStatus):
+            return NotImplemented
+        return self._values() == other._values()
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        return 'ZoneStatus({})'.format(', '.join(
+            '{}={!r}'.format(name, getattr(self, name)) for name in self.__slots__))
 
+    def diff(self, other):
+        """
+        :param other: earlier ZoneStatus of the zone or None
+        :return: dict field name -> value in self, for every field that differs
+        """
+        if other is None:
+            return {name: getattr(self, name) for name in self.__slots__}
+        return {name: getattr(self, name) for name in self.__slots__
+                if getattr(self, name) != getattr(other, name)}
 
     @classmethod
     def from_string(cls, string: bytes):
-        _LOGGER.warning("Zonestatus from_string fired")
         if not string:
             return None
-        ret = match_response(string)
-        _LOGGER.warning("Leaving ZoneStatus.From_string")
-        return ret
+        return match_response(string)
 
-def volumevaluetopercent(volumevalue: int):
+def volumevaluetopercent(volumevalue: int, scale: int = 78):
     if volumevalue == 0:
         vol = 0
     else:
-        vol = round(int(volumevalue) / 78,2)
+        vol = round(int(volumevalue) / scale,2)
         vol = round(1-vol,2)
         vol = vol * 100
-    
-    _LOGGER.warning("Converted Nuvo volume " + str(volumevalue) + " to percent value " + str(vol))
     return vol
 
 class Nuvo(object):
@@ -169,6 +259,97 @@ class Nuvo(object):
         """
         raise NotImplemented()
 
+    def restore_zones(self, statuses):
+        """
+        Restore several zones, sending only the commands whose setting differs
+        from the current state, as one batch
+        :param statuses: iterable of zone states to restore
+        :return: dict zone id -> status of the zone after the restore or None
+        """
+        raise NotImplemented()
+
+    def all_off(self, zones, all_zones: bool = False):
+        """
+        Turn a group of zones off in one batch of power commands, or every
+        zone of the amplifier with its all-zone command if it has one
+        :param zones: zone ids to turn off and report on
+        :param all_zones: True if zones are all the zones in use, only then
+            may the all-zone command switch off the whole amplifier
+        :return: dict zone id -> status of the zone after the command or None
+        """
+        raise NotImplemented()
+
+    def set_group_source(self, zones, source: int):
+        """
+        Switch a group of zones to one source in one batch
+        :param zones: zone ids
+        :param source: integer from 1 to 6
+        :return: dict zone id -> status of the zone after the command or None
+        """
+        raise NotImplemented()
+
+    def set_group_volume(self, zones, volume: float):
+        """
+        Set a group of zones to one volume in one batch
+        :param zones: zone ids
+        :param volume: as for set_volume
+        :return: dict zone id -> status of the zone after the command or None
+        """
+        raise NotImplemented()
+
+    def zone_statuses(self, zones, timeout: float = None, sent: list = None):
+        """
+        Get the status of several zones in one sweep of the port
+        :param zones: iterable of zone ids
+        :param timeout: seconds the whole sweep may take, zones that did not
+            answer by then are None and not retried; None retries them
+        :param sent: list the zones requested from the amplifier, i.e. not
+            answered from the status cache, are appended to
+        :return: dict zone id -> status of the zone or None
+        """
+        raise NotImplemented()
+
+    def add_status_listener(self, listener):
+        """
+        Register a callback for status frames the amplifier sends on its own,
+        i.e. after a change from a wall keypad
+        :param listener: callable taking the ZoneStatus, run on the reader
+        :return: callable that removes the listener
+        """
+        raise NotImplemented()
+
+    def source_names(self, sources, timeout: float = None):
+        """
+        Ask the amplifier for the names of its sources in one sweep
+        :param sources: iterable of source ids
+        :param timeout: seconds the whole sweep may take, unbounded if None
+        :return: dict source id -> name, for the sources that answered; empty
+            if the model can't report names
+        """
+        raise NotImplemented()
+
+    def add_source_listener(self, listener):
+        """
+        Register a callback for source name frames the amplifier sends on its own
+        :param listener: callable taking the SourceName, run on the reader
+        :return: callable that removes the listener
+        """
+        raise NotImplemented()
+
+    def dump_capture(self, path: str = None):
+        """
+        Write the captured traffic, see TrafficCapture.dump
+        :param path: file to write, the capture path if None
+        :return: number of frames written, None if capture is off
+        """
+        raise NotImplemented()
+
+    def close(self):
+        """
+        Stop the background reader and close the port
+        """
+        raise NotImplemented()
+
 
 # Helpers
 
@@ -179,95 +360,742 @@ def _is_int(s):
     except ValueError:
         return False
 
-def match_response(string: bytes):
-        _LOGGER.warning("match_response")
+class RetryPolicy(object):
+    """
+    Retry schedule for requests that need a status back
+    Attempts stop at whichever comes first of the attempt count and the
+    overall deadline. Delays grow exponentially from base_delay with random
+    jitter, a #Busy reply is retried after the short busy_delay instead.
+    """
 
-        match = _parse_response(string)
+    def __init__(self
+                 ,attempts: int = 4
+                 ,deadline: float = 6.0      # seconds for the whole call
+                 ,base_delay: float = 0.05
+                 ,max_delay: float = 1.0
+                 ,busy_delay: float = 0.02
+                 ,jitter: float = 0.5        # fraction of the delay randomised
+                 ):
+        self.attempts = attempts
+        self.deadline = deadline
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.busy_delay = busy_delay
+        self.jitter = jitter
+
+    def delay(self, attempt: int, busy: bool) -> float:
+        """
+        :param attempt: number of the attempt that just failed, from 1
+        :param busy: True if the amplifier answered #Busy
+        :return: seconds to wait before the next attempt
+        """
+        if busy:
+            delay = self.busy_delay
+        else:
+            delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return delay * (1 - self.jitter * random.random())
 
-        _LOGGER.warning("match_response from string match is " + str(match))
+class LatencyHistogram(object):
+    """
+    Fixed-bucket latency histogram, percentiles are reported as the upper
+    bound of the bucket they fall in
+    """
 
-        if not match:
-            _LOGGER.warning("match_response no match, returning none")
-            return None
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # last count is for samples above the highest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, pct: float) -> float:
+        """
+        :param pct: percentile from 0 to 100
+        :return: latency in seconds, 0 when empty
+        """
+        if not self.count:
+            return 0.0
+        rank = pct / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                # A bucket bound above the slowest sample would overstate it
+                return min(self.buckets[index], self.max) if index < len(self.buckets) else self.max
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count * 1000, 1) if self.count else 0.0,
+            'p50_ms': round(self.percentile(50) * 1000, 1),
+            'p95_ms': round(self.percentile(95) * 1000, 1),
+            'p99_ms': round(self.percentile(99) * 1000, 1),
+            'max_ms': round(self.max * 1000, 1),
+        }
+
+class CommandMetrics(object):
+    """
+    Counters for one command type
+    """
 
-        #try:
-        _LOGGER.warning("match_response match[0] is " + match[0])
-        if match[0] == "#ZON":
-            rtn = ZoneStatus(match[1], match[2], match[3], volumevaluetopercent(match[4]))
-            _LOGGER.warning("Back in match_response from Zonestatus")
-            _LOGGER.warning("match_response from string rtn power is " + str(rtn.power))
-            _LOGGER.warning("match_response from string rtn zone is " + str(rtn.zone))
-            _LOGGER.warning("match_response from string rtn source is " + str(rtn.source))
-            _LOGGER.warning("match_response from string rtn volume is " + str(rtn.volume))
-        
-        elif match[0] == "#ZOFF":
-            rtn = ZoneStatus(match[1], match[2], None, None)
-            _LOGGER.warning("match_response from string rtn ZOFF is " + str(rtn))            
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.retries = 0
+        self.timeouts = 0
+        self.busy = 0
 
-        else:
-            #rtn = ZoneStatus(*[str(m) for m in match.groups()])
-            _LOGGER.warning("other match")
-            rtn = ZoneStatus(match[1], match[2],None, None)
-            _LOGGER.warning("match_response from string rtn is " + str(rtn))
-        #except:
-        #    _LOGGER.warning("Error in try zonestatus (in from_string)")
-        #    rtn = None
-        _LOGGER.warning("Leaving Match_response")
+    def as_dict(self):
+        rtn = self.latency.as_dict()
+        rtn.update(retries=self.retries, timeouts=self.timeouts, busy=self.busy)
         return rtn
 
-def volumepercenttovalue(volumepercent):
-    voldB = round((volumepercent) * 78, 0)
-    if voldB < 10:
-        _LOGGER.warning("converted vol percent of " + str(volumepercent) + " to volume 0" + str(voldB))
-        return "0" + str(voldB)
-    else:
-        _LOGGER.warning("converted vol percent of " + str(volumepercent) + " to volume " + str(voldB))
-        return str(voldB)
-
-def _parse_response(string: str):
-    _LOGGER.warning(" In parse_response witn " + string)
-    """
-    :param request: request that is sent to the nuvo
-    :return: regular expression return match(s) 
-    """
-
-    match = re.search(CONCERTO_PATTERN, string)
-    if match:
-        _LOGGER.warning('CONCERTO_PATTERN - Match')
-        return match
-
-    match = re.search(ZON_PATTERN, string)
-    if match:
-        returnlist = ["#ZON"]
-        for m in match.groups():
-            returnlist.append(str(m))
-        _LOGGER.warning('Leaving Parse_response with ZON_PATTERN - Match' + str(returnlist))
-        return returnlist
-
-    match = re.search(ZOFF_PATTERN, string)
-    if match:
-        returnlist = ["#ZOFF"]
-        for m in match.groups():
-            returnlist.append(str(m))
-        _LOGGER.warning('Leaving Parse_response with ZOFF_PATTERN - Match' + str(returnlist))
-        return returnlist
-
-    match = re.search(SOURCE_PATTERN, string)
-    if match:
-        _LOGGER.debug('Leaving Parse_response with SOURCE_PATTERN - Match')
-        return match
-
-    if (string == '#Busy'):
-        _LOGGER.debug('BUSY RESPONSE - TRY AGAIN')
+class NuvoMetrics(object):
+    """
+    Transport metrics of a Nuvo interface: per command round trip latency,
+    retries, timeouts and #Busy replies, port lock wait, bytes on the wire
+    and the periods the link was down
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        # dict command name -> CommandMetrics
+        self.commands = {}
+        # per priority: time to get the port lock, callers queued now and at most
+        self.lock_wait = [LatencyHistogram() for _ in PRIORITY_NAMES]
+        self.queue_depth = [0] * len(PRIORITY_NAMES)
+        self.max_queue_depth = [0] * len(PRIORITY_NAMES)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.link_downs = 0
+        self.reconnect_attempts = 0
+        # time from the link going down to the port being reopened
+        self.reconnect = LatencyHistogram(RECONNECT_BUCKETS)
+        # time commands were held back by the pacer, and the pacer to report on
+        self.pacing = LatencyHistogram()
+        self.pacer = None
+
+    def command(self, name: str) -> CommandMetrics:
+        rtn = self.commands.get(name)
+        if rtn is None:
+            rtn = self.commands.setdefault(name, CommandMetrics())
+        return rtn
+
+    def record_response(self, request: str, seconds: float, rtn):
+        """
+        :param request: request that was sent
+        :param seconds: time from send to response, None on timeout
+        :param rtn: parsed response
+        """
+        command = self.command(_command_name(request))
+        with self._lock:
+            if seconds is None:
+                command.timeouts += 1
+            else:
+                command.latency.record(seconds)
+                if rtn is BUSY_REPLY:
+                    command.busy += 1
+
+    def record_retry(self, name: str):
+        with self._lock:
+            self.command(name).retries += 1
+
+    def record_queued(self, priority: int):
+        with self._lock:
+            self.queue_depth[priority] += 1
+            if self.queue_depth[priority] > self.max_queue_depth[priority]:
+                self.max_queue_depth[priority] = self.queue_depth[priority]
+
+    def record_lock_wait(self, seconds: float, priority: int = PRIORITY_INTERACTIVE):
+        """
+        :param seconds: time from record_queued to holding the lock
+        :param priority: priority the lock was asked for
+        """
+        with self._lock:
+            self.lock_wait[priority].record(seconds)
+            self.queue_depth[priority] = max(0, self.queue_depth[priority] - 1)
+
+    def record_link_down(self):
+        with self._lock:
+            self.link_downs += 1
+
+    def record_reconnect(self, seconds: float, attempts: int):
+        """
+        :param seconds: time the link was down
+        :param attempts: attempts it took to reopen the port
+        """
+        with self._lock:
+            self.reconnect.record(seconds)
+            self.reconnect_attempts += attempts
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'commands': {name: command.as_dict() for name, command in self.commands.items()},
+                'lock_wait': {name: histogram.as_dict() for name, histogram
+                              in zip(PRIORITY_NAMES, self.lock_wait)},
+                'queue_depth': {name: {'depth': depth, 'max_depth': max_depth}
+                                for name, depth, max_depth
+                                in zip(PRIORITY_NAMES, self.queue_depth, self.max_queue_depth)},
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'link_downs': self.link_downs,
+                'reconnect_attempts': self.reconnect_attempts,
+                'reconnect': self.reconnect.as_dict(),
+                'pacing': dict(self.pacing.as_dict(),
+                               **(self.pacer.as_dict() if self.pacer is not None else {})),
+            }
+
+class TrafficCapture(object):
+    """
+    Bounded record of the frames sent to and received from the amplifier.
+    Recording is an append to a ring buffer, the file is only written by dump
+    so that capturing does not disturb the timing it is meant to show.
+    """
+
+    def __init__(self, path: str, capacity: int = CAPTURE_FRAMES):
+        self.path = path
+        self._start = time.monotonic()
+        self._started = time.time()
+        # (time.monotonic(), 'tx' or 'rx', frame without EOL)
+        self._frames = collections.deque(maxlen=capacity)
+        self._recorded = 0
+        self._lock = Lock()
+
+    def record(self, direction: str, frame: bytes):
+        with self._lock:
+            self._frames.append((time.monotonic(), direction, frame))
+            self._recorded += 1
+
+    def dump(self, path: str = None, **header):
+        """
+        Write the buffered frames as JSON lines: a header object, then one
+        [seconds since capture start, 'tx' or 'rx', frame] list per frame
+        :param path: file to write, self.path if None
+        :param header: extra header fields, i.e. model and port
+        :return: number of frames written
+        """
+        with self._lock:
+            frames = list(self._frames)
+            dropped = self._recorded - len(frames)
+        header = dict(header, version=CAPTURE_VERSION, started=self._started, dropped=dropped)
+        with open(path or self.path, 'w') as capture:
+            capture.write(json.dumps(header) + '\n')
+            for at, direction, frame in frames:
+                capture.write(json.dumps(
+                    [round(at - self._start, 6), direction, frame.decode('latin-1')]) + '\n')
+        return len(frames)
+
+
+def read_capture(path: str):
+    """
+    Read a file written by TrafficCapture.dump
+    :return: (header dict, list of (seconds, 'tx' or 'rx', frame bytes))
+    """
+    with open(path) as capture:
+        header = json.loads(capture.readline())
+        if header.get('version') != CAPTURE_VERSION:
+            raise ValueError('Unsupported capture version {}'.format(header.get('version')))
+        frames = [(at, direction, frame.encode('latin-1'))
+                  for at, direction, frame in map(json.loads, filter(str.strip, capture))]
+    return header, frames
+
+class CommandPacer(object):
+    """
+    Paces the commands sent to the amplifier: a token bucket caps the rate
+    and the burst, a minimum gap separates the starts of two commands.
+    A #Busy reply or a timeout on a silent link halves the rate and widens the gap, every
+    answered command wins some of it back, so the pace settles just below
+    what the amplifier accepts. Not thread safe, used under the port lock.
+    """
+
+    def __init__(self
+                 ,rate: float = PACER_RATE   # commands per second to start at
+                 ,max_rate: float = None     # ceiling of the rate, rate if None
+                 ,burst: int = PIPELINE_DEPTH  # commands sent back to back on a full bucket
+                 ,min_gap: float = 0.0       # seconds between the starts of two commands, at least
+                 ):
+        self.max_rate = max_rate or rate
+        self.rate = min(rate, self.max_rate)
+        self.burst = burst
+        self.base_gap = min_gap
+        self.gap = min_gap
+        self.cuts = 0
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._last_send = 0.0
+        self._last_cut = 0.0
+
+    def delay(self) -> float:
+        """
+        :return: seconds to wait before the next command may be sent
+        """
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        wait = self._last_send + self.gap - now
+        if self._tokens < 1:
+            wait = max(wait, (1 - self._tokens) / self.rate)
+        return max(wait, 0.0)
+
+    def take(self):
+        """
+        Account for a command sent now, after delay() has passed
+        """
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate) - 1
+        self._refilled = now
+        self._last_send = now
+
+    def record(self, rtn):
+        """
+        :param rtn: response to a paced command, BUSY_REPLY, or None on a timeout
+            with nothing received after the send; a silent zone is no congestion
+        """
+        if rtn is not None and rtn is not BUSY_REPLY:
+            self.rate = min(self.max_rate, self.rate + PACER_RECOVERY)
+            self.gap = max(self.base_gap, self.gap - PACER_GAP_STEP / 10)
+            return
+        now = time.monotonic()
+        # The commands already in flight when the amplifier got busy say the same thing
+        if now - self._last_cut < PACER_HOLD:
+            return
+        self._last_cut = now
+        self.cuts += 1
+        self.rate = max(PACER_MIN_RATE, self.rate * PACER_BACKOFF)
+        self.gap = min(PACER_MAX_GAP, max(self.gap * 2, self.gap + PACER_GAP_STEP))
+        # Nothing more goes out before the bucket refills
+        self._tokens = min(self._tokens, 0.0)
+
+    def as_dict(self):
+        return {
+            'rate': round(self.rate, 1),
+            'min_gap_ms': round(self.gap * 1000, 1),
+            'cuts': self.cuts,
+        }
+
+class StatusCache(object):
+    """
+    Last ZoneStatus received for every zone, served while younger than ttl
+    Filled from every parsed status frame, whether it answers a status
+    query, a set_* command or was sent unsolicited by the amplifier.
+    """
+
+    def __init__(self, ttl: float = STATUS_CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # dict zone -> (time.monotonic() when received, ZoneStatus)
+        self._entries = {}
+        self._lock = Lock()
+
+    def get(self, zone: int):
+        """
+        :param zone: zone id
+        :return: cached ZoneStatus or None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(int(zone))
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, status: ZoneStatus):
+        with self._lock:
+            self._entries[int(status.zone)] = (time.monotonic(), status)
+
+    def invalidate(self, zone: int = None):
+        """
+        :param zone: zone id, None to drop every zone
+        """
+        with self._lock:
+            if zone is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(int(zone), None)
+
+class PriorityLock(object):
+    """
+    Reentrant lock handed over by priority: on release the waiter with the
+    lowest priority number goes next, ties in arrival order. A waiter moves
+    up one priority for every `aging` seconds it has waited, so polling
+    still gets the port under a steady stream of user commands
+    """
+
+    def __init__(self, aging: float = STARVATION_AGE):
+        self.aging = aging
+        self._cond = Condition(Lock())
+        self._owner = None
+        self._count = 0
+        # [priority, arrival number, time queued] of every waiter
+        self._waiters = []
+        self._granted = None
+        self._arrivals = 0
+
+    def _rank(self, waiter, now):
+        priority, arrival, queued = waiter
+        return max(0, priority - int((now - queued) / self.aging)), arrival
+
+    def acquire(self, priority: int):
+        me = get_ident()
+        with self._cond:
+            if self._owner == me:
+                self._count += 1
+                return
+            if self._owner is None and not self._waiters:
+                self._owner, self._count = me, 1
+                return
+            self._arrivals += 1
+            waiter = [priority, self._arrivals, time.monotonic()]
+            self._waiters.append(waiter)
+            # The releasing thread picks the next owner, so every waiter
+            # agrees on it however the aging falls
+            while self._granted is not waiter:
+                self._cond.wait()
+            self._granted = None
+            self._waiters.remove(waiter)
+            self._owner, self._count = me, 1
+
+    def preempted(self, priority: int) -> bool:
+        """
+        :param priority: priority the lock is held at
+        :return: True if a waiter outranks it
+        """
+        with self._cond:
+            now = time.monotonic()
+            return any(self._rank(waiter, now)[0] < priority for waiter in self._waiters)
+
+    def release(self):
+        with self._cond:
+            if self._owner != get_ident():
+                raise RuntimeError('cannot release un-acquired lock')
+            self._count -= 1
+            if self._count:
+                return
+            self._owner = None
+            if self._waiters:
+                now = time.monotonic()
+                self._granted = min(self._waiters, key=lambda waiter: self._rank(waiter, now))
+                self._cond.notify_all()
+
+class LatestWinsCoalescer(object):
+    """
+    Per-key latest-wins stage in front of a command
+    While a value for a key is being sent, newer submissions only replace the
+    pending value, so the wire sees the first value and then the latest one.
+    Every caller returns the result of the send that covered its value.
+    """
+
+    class _Slot(object):
+        __slots__ = ('value', 'submitted', 'taken', 'sent', 'busy', 'result')
+
+        def __init__(self):
+            self.value = None
+            self.submitted = 0   # sequence number of the latest submitted value
+            self.taken = 0       # sequence number of the value being sent
+            self.sent = 0        # sequence number of the latest value sent
+            self.busy = False
+            self.result = None
+
+    def __init__(self):
+        self._cond = Condition()
+        self._slots = {}
+        self.coalesced = 0
+
+    def submit(self, key, value, send):
+        """
+        :param key: values with the same key replace each other, i.e. (zone, 'volume')
+        :param value: value to send
+        :param send: callable sending one value and returning its result
+        :return: result of the send that carried this value or a newer one
+        """
+        with self._cond:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = self._Slot()
+            if slot.submitted > slot.taken:
+                # A value nobody has sent yet is dropped in favour of this one
+                self.coalesced += 1
+            slot.value = value
+            slot.submitted += 1
+            ticket = slot.submitted
+            while slot.busy and slot.sent < ticket:
+                self._cond.wait()
+            if slot.sent >= ticket:
+                return slot.result
+            slot.busy = True
+        try:
+            while True:
+                with self._cond:
+                    if slot.sent == slot.submitted:
+                        return slot.result
+                    value, sequence = slot.value, slot.submitted
+                    slot.taken = sequence
+                result = send(value)
+                with self._cond:
+                    slot.result, slot.sent = result, sequence
+                    self._cond.notify_all()
+        finally:
+            with self._cond:
+                slot.busy = False
+                self._cond.notify_all()
+
+class LineFramer(object):
+    """
+    Incremental EOL framer for the serial stream
+    Received chunks are appended to one bytearray, only bytes that have not
+    been scanned yet are searched for EOL, complete frames are queued and a
+    trailing partial frame is kept for the next feed.
+    """
+
+    def __init__(self, eol: bytes = EOL):
+        self._eol = eol
+        self._buffer = bytearray()
+        self._frames = collections.deque()
+
+    def feed(self, data: bytes) -> int:
+        """
+        :param data: bytes read from the port
+        :return: number of complete frames now queued
+        """
+        # Whatever is left in the buffer was scanned by the previous feed and
+        # holds no EOL, so the search starts at the new bytes
+        scanned = max(0, len(self._buffer) - len(self._eol) + 1)
+        self._buffer += data
+        start = 0
+        pos = self._buffer.find(self._eol, scanned)
+        while pos != -1:
+            self._frames.append(bytes(self._buffer[start:pos]))
+            start = pos + len(self._eol)
+            pos = self._buffer.find(self._eol, start)
+        if start:
+            del self._buffer[:start]
+        return len(self._frames)
+
+    def pop(self):
+        """
+        :return: oldest complete frame without EOL, or None
+        """
+        if self._frames:
+            return self._frames.popleft()
         return None
 
-    if not match:
-        _LOGGER.debug('NO MATCH - %s' , string)
-    _LOGGER.warning("Leaving Parse_response with No Match")
+    def clear(self):
+        """
+        Drop queued frames and any partial frame
+        """
+        self._buffer.clear()
+        self._frames.clear()
+
+def match_response(string):
+    """
+    :param string: response line from the nuvo, str or bytes
+    :return: ZoneStatus or None if the line is not a zone status
+    """
+    if isinstance(string, str):
+        string = string.encode('ascii', 'replace')
+    rtn = parse_frame(string)
+    return rtn if isinstance(rtn, ZoneStatus) else None
+
+def volumepercenttovalue(volumepercent, scale: int = 78):
+    # The amplifier takes whole dB, zero padded to two digits
+    return '{:02d}'.format(int(round(volumepercent * scale)))
+
+def parse_frame(frame: bytes):
+    """
+    Parse one response line, dispatched on its prefix so that exactly one
+    anchored matcher runs
+    :param frame: response line from the nuvo without EOL
+    :return: ZoneStatus, SourceName, BUSY_REPLY, ALL_ZONES_REPLY or None if not recognised
+    """
+    if frame.startswith(b'#Z'):
+        if frame[4:7] in (b'PWR', b'STR'):
+            # Grand Concerto status sent with a leading '#'
+            return _concerto_frame(_CONCERTO_FRAME.fullmatch(frame, 1))
+        return _essentia_frame(_ESSENTIA_FRAME.fullmatch(frame))
+    if frame.startswith(b'Z0'):
+        return _concerto_frame(_CONCERTO_FRAME.fullmatch(frame))
+    if frame == BUSY:
+        return BUSY_REPLY
+    if frame.startswith(ALL_ZONES):
+        return ALL_ZONES_REPLY
+    _LOGGER.debug('NO MATCH - %s', frame)
+    return None
+
+def _essentia_frame(match, scale: int = 78):
+    if match is None:
+        return None
+    zone, power, source, volume = match.group('zone', 'power', 'source', 'volume')
+    if source is None:
+        # Only an off zone is reported without its settings, a short ON frame
+        # lost its tail on the wire
+        if power != b'OFF':
+            return None
+        return ZoneStatus(int(zone), power.decode(), None, None)
+    volume = 0 if volume == b'MUTE' else volumevaluetopercent(volume.decode(), scale)
+    return ZoneStatus(int(zone), power.decode(), int(source), volume)
+
+def _concerto_frame(match, scale: int = 78):
+    if match is None:
+        return None
+    if match.group('name') is not None:
+        return SourceName(int(match.group('zone')), match.group('name').decode('ascii', 'replace'))
+    zone, power, source, volume = match.group('zone', 'power', 'source', 'volume')
+    volume = 0 if volume == b'MT' else volumevaluetopercent(volume[1:].decode(), scale)
+    return ZoneStatus(int(zone), power.decode(), int(source), volume)
+
+def _parse_essentia(frame: bytes, scale: int):
+    # Only the Essentia matcher runs, anything else is noise to this model
+    if frame.startswith(b'#Z'):
+        return _essentia_frame(_ESSENTIA_FRAME.fullmatch(frame), scale)
+    if frame == BUSY:
+        return BUSY_REPLY
+    if frame.startswith(ALL_ZONES):
+        return ALL_ZONES_REPLY
+    return None
+
+def _parse_concerto(frame: bytes, scale: int):
+    if frame.startswith(b'Z0'):
+        return _concerto_frame(_CONCERTO_FRAME.fullmatch(frame), scale)
+    if frame.startswith(b'#Z0'):
+        return _concerto_frame(_CONCERTO_FRAME.fullmatch(frame, 1), scale)
+    if frame == BUSY:
+        return BUSY_REPLY
+    if frame.startswith(ALL_ZONES):
+        return ALL_ZONES_REPLY
+    return None
+
+def _parse_any(frame: bytes, scale: int):
+    return parse_frame(frame)
+
+class ModelProfile(object):
+    """
+    What differs between amplifier models: the frames they send, how long
+    they take to answer, their volume scale, how fast they accept commands
+    and the all-zone commands they have
+    """
+
+    def __init__(self
+                 ,name: str
+                 ,parser                     # callable(frame, volume_scale)
+                 ,timeout: float = TIMEOUT_RESPONSE
+                 ,volume_scale: int = 78     # attenuation steps of the volume control
+                 ,min_gap: float = 0.0       # seconds between the starts of two commands, at least
+                 ,rate: float = PACER_RATE   # commands per second the pacer starts at
+                 ,max_rate: float = None     # commands per second the pacer may reach, rate if None
+                 ,pipeline_depth: int = PIPELINE_DEPTH
+                 ,max_zones: int = 20
+                 ,bulk_commands=None         # dict operation -> request for all zones
+                 ,source_name_request: str = None  # format of the name query, None if names can't be read
+                 ):
+        self.name = name
+        self.parser = parser
+        self.timeout = timeout
+        self.volume_scale = volume_scale
+        self.min_gap = min_gap
+        self.rate = rate
+        self.max_rate = max_rate or rate
+        self.pipeline_depth = pipeline_depth
+        self.max_zones = max_zones
+        self.bulk_commands = bulk_commands or {}
+        self.source_name_request = source_name_request
+
+    def parse(self, frame: bytes):
+        """
+        :param frame: response line from the nuvo without EOL
+        :return: ZoneStatus, SourceName, BUSY_REPLY, ALL_ZONES_REPLY or None if not recognised
+        """
+        return self.parser(frame, self.volume_scale)
+
+    def pacer(self) -> CommandPacer:
+        """
+        :return: new pacer for a port to an amplifier of this model
+        """
+        return CommandPacer(self.rate, self.max_rate, self.pipeline_depth, self.min_gap)
+
+    def __repr__(self):
+        return 'ModelProfile({})'.format(self.name)
+
+ESSENTIA = ModelProfile(
+    'essentia', _parse_essentia, timeout=1.5, max_zones=20, rate=1000.0,
+    bulk_commands={'all_off': 'ALLOFF', 'all_mute_on': 'ALLMON', 'all_mute_off': 'ALLMOFF'})
+
+GRAND_CONCERTO = ModelProfile(
+    'concerto', _parse_concerto, timeout=TIMEOUT_RESPONSE, min_gap=0.02, rate=40.0, max_rate=50.0,
+    pipeline_depth=2, max_zones=9,
+    bulk_commands={'all_off': 'ALLOFF', 'all_mute_on': 'ALLMON', 'all_mute_off': 'ALLMOFF'},
+    source_name_request='Z0{}STR?')
+
+# Until the first status frame tells which model answers
+AUTODETECT = ModelProfile('auto', _parse_any)
+
+PROFILES = {
+    'essentia': ESSENTIA,
+    'concerto': GRAND_CONCERTO,
+    'grand_concerto': GRAND_CONCERTO,
+    'grandconcerto': GRAND_CONCERTO,
+}
+
+def get_profile(model: str = None) -> ModelProfile:
+    """
+    :param model: model name, i.e. 'essentia' or 'concerto', None to auto-detect
+    :return: profile of the model, AUTODETECT if the name is unknown
+    """
+    if not model or model.lower() == AUTODETECT.name:
+        return AUTODETECT
+    profile = PROFILES.get(model.lower().replace(' ', '_'))
+    if profile is None:
+        _LOGGER.warning('Unknown Nuvo model "%s", detecting it from the first response', model)
+        return AUTODETECT
+    return profile
+
+def detect_profile(frame: bytes):
+    """
+    :param frame: status frame from the nuvo without EOL
+    :return: profile of the model that sends frames like it, None if not a status frame
+    """
+    if frame.startswith(b'#Z'):
+        return GRAND_CONCERTO if frame[4:7] in (b'PWR', b'STR') else ESSENTIA
+    if frame.startswith(b'Z0'):
+        return GRAND_CONCERTO
     return None
 
+# Command name by operation prefix, checked in order ('MTON' before 'ON')
+_COMMAND_NAMES = (
+    ('STATUS', 'zone_status'),
+    ('MT', 'set_mute'),
+    ('VOL', 'set_volume'),
+    ('SRC', 'set_source'),
+    ('TREB', 'set_treble'),
+    ('BASS', 'set_bass'),
+    ('STR', 'source_names'),
+    ('ALL', 'all_zones'),
+    ('ON', 'set_power'),
+    ('OFF', 'set_power'),
+)
+
+def _command_name(request: str) -> str:
+    """
+    :param request: request without framing, i.e. 'Z3VOL40'
+    :return: name of the Nuvo method that sends it
+    """
+    operation = request.lstrip('Z0123456789')
+    for prefix, name in _COMMAND_NAMES:
+        if operation.startswith(prefix):
+            return name
+    return 'other'
+
 def _format_zone_status_request(zone: int) -> str:
-    _LOGGER.warning("_format_zone_status_request - Zone for status request is " + str(zone))
     return 'Z{}STATUS?'.format(zone)
 
 def _format_set_power(zone: int, power: bool) -> str:
@@ -283,9 +1111,9 @@ def _format_set_mute(zone: int, mute: bool) -> str:
     else:
        return 'Z{}MTOFF'.format(int(zone))
 
-def _format_set_volume(zone: int, volume: float) -> str:
+def _format_set_volume(zone: int, volume: float, scale: int = 78) -> str:
     # If muted, status has no info on volume level
-    volume = volumepercenttovalue(volume)
+    volume = volumepercenttovalue(volume, scale)
 
     #if _is_int(volume):
     #   # Negative sign in volume parm produces erronous result
@@ -309,210 +1137,968 @@ def _format_set_source(zone: int, source: int) -> str:
     source = int(max(1, min(int(source), 6)))
     return 'Z{}SRC{}'.format(int(zone),source)
 
-def get_nuvo(port_url):
+def _restore_requests(status: ZoneStatus, current: ZoneStatus, scale: int = 78):
+    """
+    Commands that take a zone from its current state to a restored one
+    :param status: zone state to restore
+    :param current: current state of the zone, None if unknown
+    :param scale: volume scale of the model
+    :return: list of (zone, request) tuples, in the order they must be sent
+    """
+    zone = status.zone
+    changed = status.diff(current)
+    requests = []
+    if 'power' in changed:
+        requests.append((zone, _format_set_power(zone, status.power)))
+    if not status.power:
+        # Nothing else sticks on a zone that is switched off
+        return requests
+    if 'mute' in changed:
+        requests.append((zone, _format_set_mute(zone, status.mute)))
+    # If muted, status has no info on volume level. Status volume is the
+    # inverted attenuation percentage, the command takes the attenuation
+    if 'volume' in changed and not status.mute:
+        requests.append((zone, _format_set_volume(zone, 1 - abs(status.volume)/100, scale)))
+    if 'source' in changed and _is_int(status.source):
+        requests.append((zone, _format_set_source(zone, status.source)))
+    return requests
+
+def get_nuvo(port_url, retry_policy: RetryPolicy = None, cache_ttl: float = STATUS_CACHE_TTL,
+             model: str = None, capture: str = None):
     """
     Return synchronous version of Nuvo interface
     :param port_url: serial port, i.e. '/dev/ttyUSB0,/dev/ttyS0'
+    :param retry_policy: retry schedule for zone_status, RetryPolicy() if None
+    :param cache_ttl: seconds a received zone status answers zone_status, 0 disables
+    :param model: amplifier model, i.e. 'essentia' or 'concerto', None to auto-detect
+    :param capture: file the traffic is captured to on close or dump_capture, None disables
     :return: synchronous implementation of Nuvo interface
     """
 
-    lock = RLock()
+    lock = PriorityLock()
+
+    @contextmanager
+    def locked(nuvo, priority: int = None):
+        if priority is None:
+            priority = getattr(nuvo._context, 'priority', PRIORITY_INTERACTIVE)
+        nuvo.metrics.record_queued(priority)
+        start = time.monotonic()
+        lock.acquire(priority)
+        nuvo.metrics.record_lock_wait(time.monotonic() - start, priority)
+        try:
+            yield
+        finally:
+            lock.release()
 
     def synchronized(func):
         @wraps(func)
-        def wrapper(*args, **kwargs):
-            with lock:
-                return func(*args, **kwargs)
+        def wrapper(self, *args, **kwargs):
+            if not self.link_up:
+                # Fail fast instead of queueing behind the lock for a dead port
+                return None
+            with locked(self):
+                return func(self, *args, **kwargs)
         return wrapper
 
     class NuvoSync(Nuvo):
-        def __init__(self, port_url):
+        def __init__(self, port_url, retry_policy, cache_ttl, model, capture):
             _LOGGER.debug('Attempting connection - "%s"', port_url)
-            self._port = serial.serial_for_url(port_url, do_not_open=True)
-            self._port.baudrate = 57600
-            self._port.stopbits = serial.STOPBITS_ONE
-            self._port.bytesize = serial.EIGHTBITS
-            self._port.parity = serial.PARITY_NONE
-            self._port.timeout = TIMEOUT_OP
-            self._port.write_timeout = TIMEOUT_OP
-            self._port.open()
+            self.profile = get_profile(model)
+            self.capture = TrafficCapture(capture) if capture else None
+            self._port_url = port_url
+            self._port = self._open_port()
+            self._framer = LineFramer()
             self._nuvo = Nuvo
+            self._retry_policy = retry_policy or RetryPolicy()
+            self.status_cache = StatusCache(cache_ttl)
+            self.metrics = NuvoMetrics()
+            self.pacer = self.metrics.pacer = self.profile.pacer()
+            self._coalescer = LatestWinsCoalescer()
+            # priority of the calls made by each thread
+            self._context = local()
+            # (zone, queue) of every request in flight, oldest first
+            self._waiters = collections.deque()
+            self._waiter_lock = Lock()
+            self._status_listeners = []
+            self._source_listeners = []
+            # Link health, guarded by _waiter_lock
+            self._link_up = Event()
+            self._link_up.set()
+            self._link_failures = 0
+            self._last_rx = time.monotonic()
+            self._down_since = None
+            self._reconnect_policy = RetryPolicy(
+                base_delay=RECONNECT_DELAY, max_delay=RECONNECT_MAX_DELAY, jitter=0.2)
+            self._closing = Event()
+            self._reader = Thread(target=self._read_frames, name='nuvo-reader', daemon=True)
+            self._reader.start()
+
+        def _open_port(self):
+            port = serial.serial_for_url(self._port_url, do_not_open=True)
+            port.baudrate = 57600
+            port.stopbits = serial.STOPBITS_ONE
+            port.bytesize = serial.EIGHTBITS
+            port.parity = serial.PARITY_NONE
+            port.timeout = TIMEOUT_OP
+            port.write_timeout = TIMEOUT_OP
+            port.open()
+            return port
+
+        @property
+        def link_up(self):
+            return self._link_up.is_set()
+
+        @contextmanager
+        def priority(self, priority: int):
+            previous = getattr(self._context, 'priority', PRIORITY_INTERACTIVE)
+            self._context.priority = priority
+            try:
+                yield
+            finally:
+                self._context.priority = previous
+
+        def _link_down(self, reason: str):
+            """
+            Take the link down: fail every request in flight and let the
+            reader reopen the port
+            """
+            with self._waiter_lock:
+                if not self._link_up.is_set():
+                    return
+                self._link_up.clear()
+                self._down_since = time.monotonic()
+                waiters = list(self._waiters)
+                self._waiters.clear()
+            _LOGGER.warning('Nuvo link down (%s), reopening "%s"', reason, self._port_url)
+            self.metrics.record_link_down()
+            for _, waiter in waiters:
+                waiter.put(None)
+
+        def _record_link_result(self, answered: bool, sent: float):
+            """
+            :param answered: True if the request got a response
+            :param sent: time.monotonic() the request was sent
+            """
+            with self._waiter_lock:
+                if answered:
+                    self._link_failures = 0
+                    return
+                # A silent zone is not a dead link as long as other bytes arrive
+                if self._last_rx > sent:
+                    return
+                self._link_failures += 1
+                stalled = (self._link_failures >= LINK_FAILURES
+                           and time.monotonic() - self._last_rx >= LINK_STALL)
+            if stalled:
+                self._link_down('{} requests unanswered'.format(LINK_FAILURES))
+
+        def _reconnect(self):
+            """
+            Reopen the port with bounded backoff, run on the reader
+            """
+            try:
+                self._port.close()
+            except PORT_ERRORS:
+                pass
+            attempt = 0
+            while not self._closing.is_set():
+                attempt += 1
+                try:
+                    port = self._open_port()
+                except PORT_ERRORS as err:
+                    delay = self._reconnect_policy.delay(attempt, False)
+                    _LOGGER.debug('Reopening "%s" failed (%s), next attempt in %.1f s',
+                                  self._port_url, err, delay)
+                    self._closing.wait(delay)
+                    continue
+                self._port = port
+                self._framer.clear()
+                with self._waiter_lock:
+                    self._link_failures = 0
+                    self._last_rx = time.monotonic()
+                    down = self._last_rx - self._down_since
+                self.metrics.record_reconnect(down, attempt)
+                _LOGGER.warning('Nuvo link restored after %.1f s', down)
+                self._link_up.set()
+                return
 
 
         def _send_request(self, request):
-            _LOGGER.warning("send_request")
             """
             :param request: request that is sent to the nuvo
             :return: bool if transmit success
             """
             #format and send output command
-            lineout = "*" + request + "\r"
-            _LOGGER.warning('Sending "%s"', lineout)
-            #Below line is not displayed properly in logger
-            #_LOGGER.info('Sending "%s"', lineout)
-            self._port.write(lineout.encode())
+            lineout = ("*" + request + "\r").encode()
+            if _TRACE():
+                _LOGGER.debug('Sending %s', lineout)
+            # Sending faster than the amplifier takes commands only buys #Busy replies
+            pacer = self.pacer
+            delay = pacer.delay()
+            if delay > 0:
+                time.sleep(delay)
+            self.metrics.pacing.record(delay)
+            pacer.take()
+            if self.capture is not None:
+                self.capture.record('tx', lineout[:-1])
+            self._port.write(lineout)
             self._port.flush() # it is buffering
-            _LOGGER.warning("Leaving send_request")
+            self.metrics.bytes_out += len(lineout)
             return True
 
 
-        def _listen_maybewait(self, wait_for_response: bool, first_execution: bool):
-            _LOGGER.warning("Listen_maybewait")
-
-            no_data = False
-            receive_buffer = b''
-            message = b''
-            start_time = time.time()
-            timeout = TIMEOUT_RESPONSE 
-
-            # listen for response
-            while (no_data == False):
-               # Exit if timeout
-               if( (time.time() - start_time) > timeout ):
-                  _LOGGER.warning('Leaving Listen_maybewait - Expected response from command but no response before timeout')
-                  return None
-               # fill buffer until we get term seperator 
-               data = self._port.read(1)
-
-               if data:
-                  receive_buffer += data
-
-                  if EOL in receive_buffer:
-                     message, sep, receive_buffer = receive_buffer.partition(EOL)
-                     _LOGGER.warning('Listen_maybe_wait Received this: %s', message)
-                     stringmessage = message.decode('ascii')
-                     stringmessage = stringmessage.strip()
-                     rtn = match_response(stringmessage)
-                     _LOGGER.warning("Leaving listen_maybewait - return from match_response is " + str(rtn))
-                     #rtn = _parse_response(stringmessage)
-                     return(rtn)
-                  else:
-                     _LOGGER.debug('Listen_maybewait - Expecting response from command sent - Data received but no EOL yet :(')
-               else:
-                  _LOGGER.warning('Listen_maybewaitExpecting response from command sent - No Data received')
-                  if ( wait_for_response == False ): 
-                     no_data = True
-                     if first_execution:
-                         _LOGGER.warning("Leaving Listen_maybewait because first execution. return none")
-                         return None
-                  continue
-
-            _LOGGER.warning("Listen_maybewait - Should never get here")
+        def _read_frames(self):
+            """
+            Persistent reader: owns every read from the port, hands the next
+            frame to the request waiting for a response and publishes any other
+            status frame, e.g. a keypad change, to the status listeners
+            """
+            while not self._closing.is_set():
+                if not self._link_up.is_set():
+                    self._reconnect()
+                    continue
+                try:
+                    # blocks for one byte up to TIMEOUT_OP, then takes everything waiting
+                    data = self._port.read(self._port.in_waiting or 1)
+                except PORT_ERRORS as err:
+                    _LOGGER.error('Error reading from Nuvo controller: %s', err)
+                    self._link_down('read error')
+                    continue
+                except Exception:
+                    # The reader is the only one reopening the port, it must not die
+                    _LOGGER.exception('Unexpected error reading from Nuvo controller')
+                    self._link_down('read error')
+                    continue
+                if not data:
+                    continue
+                self._last_rx = time.monotonic()
+                self.metrics.bytes_in += len(data)
+                self._framer.feed(data)
+                message = self._framer.pop()
+                while message is not None:
+                    if self.capture is not None:
+                        self.capture.record('rx', message)
+                    try:
+                        self._handle_frame(message)
+                    except Exception:
+                        _LOGGER.exception('Error handling Nuvo frame %s', message)
+                    message = self._framer.pop()
+
+        def _handle_frame(self, message: bytes):
+            if _TRACE():
+                _LOGGER.debug('Received %s', message)
+            message = message.strip()
+            rtn = self.profile.parse(message)
+            is_status = isinstance(rtn, ZoneStatus)
+            is_name = isinstance(rtn, SourceName)
+            if is_status:
+                if self.profile is AUTODETECT:
+                    self.profile = detect_profile(message)
+                    self.pacer = self.metrics.pacer = self.profile.pacer()
+                    _LOGGER.info('Detected Nuvo %s on "%s"', self.profile.name, self._port_url)
+                self.status_cache.put(rtn)
+                key = rtn.zone
+            elif is_name:
+                key = _source_key(rtn.source)
+            else:
+                key = None
+            waiter = self._claim_waiter(key)
+            if waiter is not None:
+                waiter.put(rtn)
+            elif is_status or is_name:
+                listeners = self._status_listeners if is_status else self._source_listeners
+                for listener in list(listeners):
+                    try:
+                        listener(rtn)
+                    except Exception:
+                        _LOGGER.exception('Error in Nuvo status listener')
+
+        def _claim_waiter(self, key):
+            """
+            Correlate a frame with the request it answers
+            :param key: zone of a status frame, _source_key of a source name,
+                None for #Busy and other replies
+            :return: queue of the matching request or None if unsolicited
+            """
+            with self._waiter_lock:
+                for pending in self._waiters:
+                    # Status and name frames carry their key; anything else answers the oldest request
+                    if key is None or pending[0] == key:
+                        self._waiters.remove(pending)
+                        return pending[1]
             return None
 
-        def _process_request(self, request: str, first_execution:bool):
-            _LOGGER.warning("process_request")
+        def _process_pipelined(self, requests, timeout: float = None,
+                               deadline: float = None, preempt=None):
+            """
+            Send requests with up to pipeline_depth of the profile awaiting a response
+            :param requests: list of (zone, request) tuples, _source_key instead
+                of the zone for a source name request
+            :param timeout: seconds to wait for each response, the profile timeout if None
+            :param deadline: time.monotonic() after which nothing more is sent or awaited
+            :param preempt: callable, once true after the first send the requests
+                not sent yet are left out of the result for the caller to resend
+            :return: list of ZoneStatus, BUSY_REPLY or None on timeout, in request order
+            """
+            results = [None] * len(requests)
+            inflight = collections.deque()
+            if deadline is None:
+                deadline = float('inf')
+            if timeout is None:
+                timeout = self.profile.timeout
+            depth = self.profile.pipeline_depth
+
+            def collect():
+                index, pending, sent = inflight.popleft()
+                request = requests[index][1]
+                try:
+                    results[index] = pending[1].get(
+                        timeout=max(0, min(sent + timeout, deadline) - time.monotonic()))
+                except queue.Empty:
+                    _LOGGER.warning('No response to "%s" before timeout', request)
+                    self.metrics.record_response(request, None, None)
+                    with self._waiter_lock:
+                        if pending in self._waiters:
+                            self._waiters.remove(pending)
+                    self._record_link_result(False, sent)
+                    if self._last_rx <= sent:
+                        # The amplifier went quiet, not just a zone that never answers
+                        self.pacer.record(None)
+                else:
+                    if results[index] is None:
+                        # Failed by _link_down
+                        self.metrics.record_response(request, None, None)
+                        return
+                    self.metrics.record_response(request, time.monotonic() - sent, results[index])
+                    self._record_link_result(True, sent)
+                    self.pacer.record(results[index])
+
+            for index, (zone, request) in enumerate(requests):
+                if len(inflight) >= depth:
+                    collect()
+                if time.monotonic() >= deadline or not self._link_up.is_set():
+                    break
+                if index and preempt is not None and preempt():
+                    del results[index:]
+                    break
+                is_zone = not isinstance(zone, tuple)
+                pending = (int(zone) if is_zone else zone, queue.Queue(maxsize=1))
+                with self._waiter_lock:
+                    self._waiters.append(pending)
+                if is_zone:
+                    # The zone is about to change or be re-read, its cached status is stale
+                    self.status_cache.invalidate(zone)
+                try:
+                    self._send_request(request)
+                except PORT_ERRORS as err:
+                    # The waiter was registered ahead of the write so that a fast
+                    # reply finds it, nothing will answer it now
+                    with self._waiter_lock:
+                        if pending in self._waiters:
+                            self._waiters.remove(pending)
+                    _LOGGER.error('Error writing to Nuvo controller: %s', err)
+                    self._link_down('write error')
+                    break
+                inflight.append((index, pending, time.monotonic()))
+            while inflight:
+                collect()
+            return results
+
+        def _process_request(self, zone: int, request: str):
             """
+            :param zone: zone the request is addressed to
             :param request: request that is sent to the nuvo
-            :return: ascii string returned by nuvo
+            :return: ZoneStatus parsed from the response or None on timeout
             """
-            # Process any messages that have already been received 
-            self._listen_maybewait(False, first_execution)
-            _LOGGER.warning("Back in Process Request from 1st listen_maybewait")
-            # Send command to device
-            self._send_request(request)
-            _LOGGER.warning("Back in Process_request from send_request")
-            # Process expected response
-            rtn =  self._listen_maybewait(True, False)
-            _LOGGER.warning("Back in Process Request from 2nd listen_maybewait")
-            _LOGGER.warning("Leaving Process_request")
-            return rtn
+            rtn = self._process_pipelined([(zone, request)])[0]
+            return None if rtn is BUSY_REPLY else rtn
+
+        def add_status_listener(self, listener):
+            self._status_listeners.append(listener)
+            return lambda: self._status_listeners.remove(listener)
+
+        def add_source_listener(self, listener):
+            self._source_listeners.append(listener)
+            return lambda: self._source_listeners.remove(listener)
+
+        def source_names(self, sources, timeout: float = None):
+            request = self.profile.source_name_request
+            if request is None or not self.link_up:
+                return {}
+            deadline = None if timeout is None else time.monotonic() + timeout
+            sources = list(sources)
+            with locked(self):
+                responses = self._process_pipelined(
+                    [(_source_key(source), request.format(source)) for source in sources],
+                    deadline=deadline)
+            return {source: rtn.name for source, rtn in zip(sources, responses)
+                    if isinstance(rtn, SourceName)}
+
+        def dump_capture(self, path: str = None):
+            if self.capture is None:
+                return None
+            return self.capture.dump(path, model=self.profile.name, port=self._port_url)
+
+        def close(self):
+            self._closing.set()
+            self._reader.join()
+            self._port.close()
+            self.dump_capture()
 
-        @synchronized
         def zone_status(self, zone: int):
-            _LOGGER.warning("zone_status for " + str(zone))
-            # Send command multiple times, since we need result back, and rarely response can be wrong type 
-            for count in range(1,5):
-               try:
-                  #_LOGGER.warning("Calling Zone status request from zone_status for zone" + str(zone) + " and count is " + str(count))
-                  #rtn = ZoneStatus.from_string(self._process_request(_format_zone_status_request(zone), False))
-                  rtn = self._process_request(_format_zone_status_request(zone), False)
-                  _LOGGER.warning("Back in zone_status and count is " + str(count))
-                  if rtn == None:
-                     _LOGGER.warning('Zone Status Request - Response Invalid - Retry Count: %d' , count)
-                     raise ValueError('Zone Status Request - Response Invalid')
-                  else:
-                     _LOGGER.warning("Got the response we were looking for")
-                     return rtn
-               except:
-                  rtn = None
-               #Wait 1 sec between retry attempt(s)
-               time.sleep(1)
-               continue  # end of for loop // retry
-            _LOGGER.warning("Leaving zone_status")
-            return rtn
+            _LOGGER.debug('zone_status for %s', zone)
+            rtn = self.status_cache.get(zone)
+            if rtn is not None or not self.link_up:
+                return rtn
+            policy = self._retry_policy
+            deadline = time.monotonic() + policy.deadline
+            # Send command multiple times, since we need result back, and rarely response can be wrong type
+            for attempt in range(1, policy.attempts + 1):
+                # The lock is only held for the attempt so queued commands run between retries
+                with locked(self):
+                    rtn = self._process_pipelined(
+                        [(zone, _format_zone_status_request(zone))],
+                        min(self.profile.timeout, max(0, deadline - time.monotonic())))[0]
+                if rtn is not None and rtn is not BUSY_REPLY:
+                    return rtn
+                delay = policy.delay(attempt, rtn is BUSY_REPLY)
+                if (attempt == policy.attempts or time.monotonic() + delay >= deadline
+                        or not self.link_up):
+                    break
+                _LOGGER.debug('Zone Status Request - Response Invalid - Retry Count: %d', attempt)
+                self.metrics.record_retry('zone_status')
+                time.sleep(delay)
+            _LOGGER.warning('Zone %s status request unanswered', zone)
+            return None
 
         @synchronized
         def set_power(self, zone: int, power: bool):
-            _LOGGER.warning("Set_power to " + str(power) + " in zone "+ str(zone))
-            rtn = self._process_request(_format_set_power(zone, power), False)
-            _LOGGER.warning("back in set_power from Process_request and now leaving set_power with " + str(rtn))
+            if _TRACE():
+                _LOGGER.debug('set_power to %s in zone %s', power, zone)
+            rtn = self._process_request(zone, _format_set_power(zone, power))
             return rtn
 
-        @synchronized
         def set_mute(self, zone: int, mute: bool):
-            _LOGGER.warning("set_mute to " + str(mute) + " in zone "+ str(zone))
-            rtn = self._process_request(_format_set_mute(zone, mute), False)
-            _LOGGER.warning("back in set_mute from process_request and now leaving set_mute with " + str(rtn))
-            return rtn
+            return self._coalescer.submit(
+                (int(zone), 'mute'), mute, functools.partial(self._set_mute, zone))
 
         @synchronized
+        def _set_mute(self, zone: int, mute: bool):
+            if _TRACE():
+                _LOGGER.debug('set_mute to %s in zone %s', mute, zone)
+            rtn = self._process_request(zone, _format_set_mute(zone, mute))
+            return rtn
+
         def set_volume(self, zone: int, volume: float):
-            _LOGGER.warning("set_volume to " + str(volume) + " in zone "+ str(zone))
-            _LOGGER.warning("abs(volume is " + str(abs(volume)))
-            _LOGGER.warning("abs(volume)/100 is " + str(abs(volume)/100))
-            rtn = self._process_request(_format_set_volume(zone, (abs(volume)/100)), False)
-            _LOGGER.warning("back in set_volume from process_request and now leaving set_volume with " + str(rtn))
+            # Slider drags and repeated steps only send the latest target
+            return self._coalescer.submit(
+                (int(zone), 'volume'), volume, functools.partial(self._set_volume, zone))
+
+        @synchronized
+        def _set_volume(self, zone: int, volume: float):
+            if _TRACE():
+                _LOGGER.debug('set_volume to %s in zone %s', volume, zone)
+            rtn = self._process_request(
+                zone, _format_set_volume(zone, (abs(volume)/100), self.profile.volume_scale))
             return rtn
 
         @synchronized
         def set_treble(self, zone: int, treble: float):
-            _LOGGER.warning("set_treble in zone "+ str(zone))
-            rtn = self._process_request(_format_set_treble(zone, treble), False)
-            _LOGGER.warning("back in set_treble from process_request and now leaving set_treble with " + str(rtn))
+            if _TRACE():
+                _LOGGER.debug('set_treble to %s in zone %s', treble, zone)
+            rtn = self._process_request(zone, _format_set_treble(zone, treble))
             return rtn
 
         @synchronized
         def set_bass(self, zone: int, bass: float):
-            _LOGGER.warning("set_bass in zone "+ str(zone))
-            rtn = self._process_request(_format_set_bass(zone, bass), False)
-            _LOGGER.warning("back in set_bass from process_request and now leaving set_base with " + str(rtn))
+            if _TRACE():
+                _LOGGER.debug('set_bass to %s in zone %s', bass, zone)
+            rtn = self._process_request(zone, _format_set_bass(zone, bass))
             return rtn
 
         @synchronized
         def set_source(self, zone: int, source: int):
-            _LOGGER.warning("set_source to " + str(source) + " in zone "+ str(zone))
-            rtn = self._process_request(_format_set_source(zone, source), False)
-            _LOGGER.warning("back in set_source from process_request and now leaving set_source with " + str(rtn))
+            if _TRACE():
+                _LOGGER.debug('set_source to %s in zone %s', source, zone)
+            rtn = self._process_request(zone, _format_set_source(zone, source))
             return rtn
 
-        @synchronized
         def restore_zone(self, status: ZoneStatus):
-            _LOGGER.warning("restore_zone")
-            self.set_power(status.zone, status.power)
-            self.set_mute(status.zone, status.mute)
-            self.set_volume(status.zone, status.volume)
-            self.set_source(status.zone, status.source)
-            _LOGGER.warning("Leaving restore_zone")
+            _LOGGER.debug('restore_zone %s', status.zone)
+            return self.restore_zones([status]).get(status.zone)
 
 #            self.set_treble(status.zone, status.treble)
 #            self.set_bass(status.zone, status.bass)
 
-    
-    _LOGGER.warning("about to leave NuvoSync")
-    return NuvoSync(port_url)
+        def restore_zones(self, statuses):
+            statuses = [status for status in statuses if status is not None]
+            # One sweep for the current state, cache hits are free
+            with self.priority(PRIORITY_BULK):
+                current = self.zone_statuses([status.zone for status in statuses])
+            requests = []
+            for status in statuses:
+                requests.extend(_restore_requests(
+                    status, current.get(status.zone), self.profile.volume_scale))
+            _LOGGER.debug('restore_zones: %d commands for %d zones', len(requests), len(statuses))
+            # Commands go straight to the wire: waiting on a coalesced send
+            # while holding the lock would deadlock with the caller sending it
+            current.update(self._process_group(requests, PRIORITY_BULK, 'restore_zones'))
+            return current
+
+        def _process_group(self, requests, priority: int = PRIORITY_INTERACTIVE,
+                           name: str = 'group'):
+            """
+            Send commands to several zones, resending the commands of a zone
+            from the first one answered #Busy. Passes go on while each one gets
+            some command answered, the retry policy bounds the passes in a row
+            that get none and the time spent resending.
+            :param requests: list of (zone, request) tuples, in the order each zone needs them
+            :param priority: priority the lock is taken at for every pass
+            :param name: command name the retries are counted under
+            :return: dict zone -> status after its last request, None unless
+                every request of the zone was answered
+            """
+            policy = self._retry_policy
+            deadline = None
+            statuses = {zone: None for zone, _ in requests}
+            failed = set()
+            attempt = 0
+            while True:
+                with locked(self, priority):
+                    responses = self._process_pipelined(requests)
+                if deadline is None:
+                    deadline = time.monotonic() + policy.deadline
+                sent = len(requests)
+                resend = collections.OrderedDict()
+                for (zone, request), rtn in zip(requests, responses):
+                    if zone in resend:
+                        # Later commands of the zone follow the one that was refused
+                        resend[zone].append((zone, request))
+                    elif rtn is BUSY_REPLY:
+                        resend[zone] = [(zone, request)]
+                    elif rtn is None:
+                        failed.add(zone)
+                    else:
+                        statuses[zone] = rtn
+                requests = [request for pending in resend.values() for request in pending]
+                if not requests:
+                    break
+                attempt = attempt + 1 if len(requests) == sent else 1
+                delay = policy.delay(attempt, True)
+                if (attempt == policy.attempts or time.monotonic() + delay >= deadline
+                        or not self.link_up):
+                    failed.update(resend)
+                    break
+                self.metrics.record_retry(name)
+                time.sleep(delay)
+            for zone in failed:
+                statuses[zone] = None
+            return statuses
+
+        def all_off(self, zones, all_zones: bool = False):
+            zones = list(zones)
+            request = self.profile.bulk_commands.get('all_off') if all_zones else None
+            if request is not None and self.link_up:
+                with locked(self):
+                    # Unsolicited status frames a zone sends while switching
+                    # off must not be taken for the acknowledgement
+                    rtn = self._process_pipelined([(('all', request), request)])[0]
+                if rtn is ALL_ZONES_REPLY:
+                    statuses = {}
+                    for zone in zones:
+                        statuses[zone] = ZoneStatus(int(zone), 'OFF', None, None)
+                        self.status_cache.put(statuses[zone])
+                    return statuses
+                _LOGGER.debug('%s not acknowledged, turning zones off one by one', request)
+            return self._process_group([(zone, _format_set_power(zone, False)) for zone in zones])
+
+        def set_group_source(self, zones, source: int):
+            return self._process_group(
+                [(zone, _format_set_source(zone, source)) for zone in zones])
+
+        def set_group_volume(self, zones, volume: float):
+            volume = abs(volume)/100
+            return self._process_group(
+                [(zone, _format_set_volume(zone, volume, self.profile.volume_scale))
+                 for zone in zones])
+
+        def zone_statuses(self, zones, timeout: float = None, sent: list = None):
+            # The zones missing from the cache are swept in one pipelined
+            # lock hold that gives way as soon as a higher priority command
+            # queues, zones that did not answer go through the zone_status
+            # retries afterwards unless the sweep is time-boxed
+            deadline = None if timeout is None else time.monotonic() + timeout
+            statuses = {zone: self.status_cache.get(zone) for zone in zones}
+            zones = [zone for zone, status in statuses.items() if status is None]
+            if not self.link_up:
+                return statuses
+            priority = getattr(self._context, 'priority', PRIORITY_INTERACTIVE)
+            preempt = functools.partial(lock.preempted, priority)
+            unsent = zones
+            while unsent:
+                with locked(self, priority):
+                    responses = self._process_pipelined(
+                        [(zone, _format_zone_status_request(zone)) for zone in unsent],
+                        deadline=deadline, preempt=preempt)
+                statuses.update(zip(unsent, responses))
+                if sent is not None:
+                    sent.extend(unsent[:len(responses)])
+                unsent = unsent[len(responses):]
+            for zone in zones:
+                if statuses[zone] is None or statuses[zone] is BUSY_REPLY:
+                    statuses[zone] = self.zone_status(zone) if deadline is None else None
+            return statuses
+
+    return NuvoSync(port_url, retry_policy, cache_ttl, model, capture)
+
+
+async def get_nuvo_async(port_url, loop=None, retry_policy: RetryPolicy = None,
+                         cache_ttl: float = STATUS_CACHE_TTL, model: str = None,
+                         capture: str = None):
+    """
+    Return asynchronous version of Nuvo interface
+    :param port_url: serial port, i.e. '/dev/ttyUSB0,/dev/ttyS0'
+    :param loop: asyncio event loop, defaults to the running loop
+    :param retry_policy: retry schedule for zone_status, RetryPolicy() if None
+    :param cache_ttl: seconds a received zone status answers zone_status, 0 disables
+    :param model: amplifier model, i.e. 'essentia' or 'concerto', None to auto-detect
+    :param capture: file the traffic is captured to on close or dump_capture, None disables
+    :return: asynchronous implementation of Nuvo interface
+    """
+    from serial_asyncio import open_serial_connection
+
+    lock = asyncio.Lock()
+
+    @asynccontextmanager
+    async def locked(nuvo):
+        start = nuvo._loop.time()
+        async with lock:
+            nuvo.metrics.record_lock_wait(nuvo._loop.time() - start)
+            yield
+
+    def locked_coro(coro):
+        @wraps(coro)
+        async def wrapper(self, *args, **kwargs):
+            async with locked(self):
+                return await coro(self, *args, **kwargs)
+        return wrapper
+
+    class NuvoAsync(Nuvo):
+        def __init__(self, port_url, reader, writer, loop, retry_policy, cache_ttl, model,
+                     capture):
+            self.profile = get_profile(model)
+            self.capture = TrafficCapture(capture) if capture else None
+            self._port_url = port_url
+            self._reader = reader
+            self._writer = writer
+            self._loop = loop
+            self._retry_policy = retry_policy or RetryPolicy()
+            self.status_cache = StatusCache(cache_ttl)
+            self.metrics = NuvoMetrics()
+            self.pacer = self.metrics.pacer = self.profile.pacer()
+            # Future of the command currently waiting for its response line
+            self._pending = None
+            # Zone, or _source_key, the pending command expects an answer
+            # from, None to take the next frame whatever it is
+            self._pending_key = None
+            # loop.time() of the last frame received
+            self._last_rx = loop.time()
+            self._status_listeners = []
+            self._source_listeners = []
+            self._reader_task = loop.create_task(self._read_frames())
+
+        async def _read_frames(self):
+            """
+            Single reader task: split the stream on EOL and hand every frame
+            to the command waiting for it
+            """
+            while True:
+                try:
+                    line = await self._reader.readuntil(EOL)
+                except asyncio.IncompleteReadError:
+                    _LOGGER.error('Nuvo serial connection closed')
+                    break
+                except asyncio.LimitOverrunError as err:
+                    # Drop the garbage and resynchronise on the next EOL
+                    await self._reader.readexactly(err.consumed)
+                    continue
+                self.metrics.bytes_in += len(line)
+                self._last_rx = self._loop.time()
+                if self.capture is not None:
+                    self.capture.record('rx', line[:-len(EOL)])
+                if _TRACE():
+                    _LOGGER.debug('Received %s', line)
+                line = line.strip()
+                rtn = self.profile.parse(line)
+                is_status = isinstance(rtn, ZoneStatus)
+                is_name = isinstance(rtn, SourceName)
+                if is_status:
+                    if self.profile is AUTODETECT:
+                        self.profile = detect_profile(line)
+                        self.pacer = self.metrics.pacer = self.profile.pacer()
+                        _LOGGER.info('Detected Nuvo %s', self.profile.name)
+                    self.status_cache.put(rtn)
+                    key = rtn.zone
+                elif is_name:
+                    key = _source_key(rtn.source)
+                else:
+                    key = None
+                # Status and name frames carry their key, a keypad change of
+                # another zone is not the answer; anything else answers the command
+                if (self._pending is not None and not self._pending.done()
+                        and (key is None or self._pending_key in (None, key))):
+                    self._pending.set_result(rtn)
+                elif is_status or is_name:
+                    listeners = self._status_listeners if is_status else self._source_listeners
+                    for listener in list(listeners):
+                        try:
+                            listener(rtn)
+                        except Exception:
+                            _LOGGER.exception('Error in Nuvo status listener')
+
+            if self._pending is not None and not self._pending.done():
+                self._pending.set_result(None)
+
+        async def _exchange(self, zone: int, request: str, timeout: float = None):
+            """
+            :param zone: zone the request is addressed to
+            :param request: request that is sent to the nuvo
+            :param timeout: seconds to wait for the response, the profile timeout if None
+            :return: ZoneStatus parsed from the response, BUSY_REPLY or None on timeout
+            """
+            if timeout is None:
+                timeout = self.profile.timeout
+            # Sending faster than the amplifier takes commands only buys #Busy replies
+            pacer = self.pacer
+            delay = pacer.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.metrics.pacing.record(delay)
+            pacer.take()
+            self._pending = self._loop.create_future()
+            # Only a frame of this zone, or a keyless reply such as #Busy, answers
+            self._pending_key = zone if isinstance(zone, tuple) else int(zone)
+            if not isinstance(zone, tuple):
+                # The zone is about to change or be re-read, its cached status is stale
+                self.status_cache.invalidate(zone)
+            lineout = "*" + request + "\r"
+            if _TRACE():
+                _LOGGER.debug('Sending "%s"', lineout)
+            if self.capture is not None:
+                self.capture.record('tx', lineout[:-1].encode())
+            self._writer.write(lineout.encode())
+            self.metrics.bytes_out += len(lineout)
+            await self._writer.drain()
+            sent = self._loop.time()
+            try:
+                rtn = await asyncio.wait_for(self._pending, timeout)
+            except asyncio.TimeoutError:
+                _LOGGER.warning('No response to "%s" before timeout', request)
+                self.metrics.record_response(request, None, None)
+                if self._last_rx <= sent:
+                    # The amplifier went quiet, not just a zone that never answers
+                    pacer.record(None)
+                return None
+            finally:
+                self._pending = None
+                self._pending_key = None
+            self.metrics.record_response(request, self._loop.time() - sent, rtn)
+            pacer.record(rtn)
+            return rtn
+
+        async def _process_request(self, zone: int, request: str):
+            """
+            :param zone: zone the request is addressed to
+            :param request: request that is sent to the nuvo
+            :return: ZoneStatus parsed from the response or None
+            """
+            rtn = await self._exchange(zone, request)
+            return None if rtn is BUSY_REPLY else rtn
+
+        async def zone_status(self, zone: int):
+            rtn = self.status_cache.get(zone)
+            if rtn is not None:
+                return rtn
+            policy = self._retry_policy
+            deadline = self._loop.time() + policy.deadline
+            # Send command multiple times, since we need result back, and rarely response can be wrong type
+            for attempt in range(1, policy.attempts + 1):
+                # The lock is only held for the attempt so queued commands run between retries
+                async with locked(self):
+                    rtn = await self._exchange(
+                        zone, _format_zone_status_request(zone),
+                        min(self.profile.timeout, max(0, deadline - self._loop.time())))
+                if rtn is not None and rtn is not BUSY_REPLY:
+                    return rtn
+                delay = policy.delay(attempt, rtn is BUSY_REPLY)
+                if attempt == policy.attempts or self._loop.time() + delay >= deadline:
+                    break
+                _LOGGER.debug('Zone Status Request - Response Invalid - Retry Count: %d', attempt)
+                self.metrics.record_retry('zone_status')
+                await asyncio.sleep(delay)
+            _LOGGER.warning('Zone %s status request unanswered', zone)
+            return None
+
+        @locked_coro
+        async def set_power(self, zone: int, power: bool):
+            return await self._process_request(zone, _format_set_power(zone, power))
+
+        @locked_coro
+        async def set_mute(self, zone: int, mute: bool):
+            return await self._process_request(zone, _format_set_mute(zone, mute))
+
+        @locked_coro
+        async def set_volume(self, zone: int, volume: float):
+            return await self._process_request(
+                zone, _format_set_volume(zone, (abs(volume)/100), self.profile.volume_scale))
+
+        @locked_coro
+        async def set_treble(self, zone: int, treble: float):
+            return await self._process_request(zone, _format_set_treble(zone, treble))
+
+        @locked_coro
+        async def set_bass(self, zone: int, bass: float):
+            return await self._process_request(zone, _format_set_bass(zone, bass))
+
+        @locked_coro
+        async def set_source(self, zone: int, source: int):
+            return await self._process_request(zone, _format_set_source(zone, source))
+
+        async def restore_zone(self, status: ZoneStatus):
+            return (await self.restore_zones([status])).get(status.zone)
+
+        async def restore_zones(self, statuses):
+            statuses = [status for status in statuses if status is not None]
+            current = await self.zone_statuses([status.zone for status in statuses])
+            requests = []
+            for status in statuses:
+                requests.extend(_restore_requests(
+                    status, current.get(status.zone), self.profile.volume_scale))
+            async with locked(self):
+                for zone, request in requests:
+                    current[zone] = await self._process_request(zone, request)
+            return current
+
+        async def _process_group(self, requests):
+            statuses = {}
+            async with locked(self):
+                for zone, request in requests:
+                    statuses[zone] = await self._process_request(zone, request)
+            return statuses
+
+        async def all_off(self, zones, all_zones: bool = False):
+            zones = list(zones)
+            request = self.profile.bulk_commands.get('all_off') if all_zones else None
+            if request is not None:
+                async with locked(self):
+                    rtn = await self._exchange(('all', request), request)
+                if rtn is ALL_ZONES_REPLY:
+                    statuses = {}
+                    for zone in zones:
+                        statuses[zone] = ZoneStatus(int(zone), 'OFF', None, None)
+                        self.status_cache.put(statuses[zone])
+                    return statuses
+            return await self._process_group(
+                [(zone, _format_set_power(zone, False)) for zone in zones])
+
+        async def set_group_source(self, zones, source: int):
+            return await self._process_group(
+                [(zone, _format_set_source(zone, source)) for zone in zones])
+
+        async def set_group_volume(self, zones, volume: float):
+            volume = abs(volume)/100
+            return await self._process_group(
+                [(zone, _format_set_volume(zone, volume, self.profile.volume_scale))
+                 for zone in zones])
+
+        async def zone_statuses(self, zones, timeout: float = None, sent: list = None):
+            # The lock is held for one pass over the zones missing from the
+            # cache, zones that did not answer go through the zone_status
+            # retries afterwards unless the sweep is time-boxed
+            deadline = None if timeout is None else self._loop.time() + timeout
+            statuses = {zone: self.status_cache.get(zone) for zone in zones}
+            zones = [zone for zone, status in statuses.items() if status is None]
+            async with locked(self):
+                for zone in zones:
+                    wait = self.profile.timeout
+                    if deadline is not None:
+                        wait = min(wait, deadline - self._loop.time())
+                        if wait <= 0:
+                            break
+                    if sent is not None:
+                        sent.append(zone)
+                    statuses[zone] = await self._exchange(zone, _format_zone_status_request(zone), wait)
+            for zone in zones:
+                if statuses[zone] is None or statuses[zone] is BUSY_REPLY:
+                    statuses[zone] = await self.zone_status(zone) if deadline is None else None
+            return statuses
+
+        def add_status_listener(self, listener):
+            self._status_listeners.append(listener)
+            return lambda: self._status_listeners.remove(listener)
+
+        def add_source_listener(self, listener):
+            self._source_listeners.append(listener)
+            return lambda: self._source_listeners.remove(listener)
+
+        async def source_names(self, sources, timeout: float = None):
+            request = self.profile.source_name_request
+            if request is None:
+                return {}
+            deadline = None if timeout is None else self._loop.time() + timeout
+            names = {}
+            async with locked(self):
+                for source in sources:
+                    wait = self.profile.timeout
+                    if deadline is not None:
+                        wait = min(wait, deadline - self._loop.time())
+                        if wait <= 0:
+                            break
+                    rtn = await self._exchange(
+                        _source_key(source), request.format(source), wait)
+                    if isinstance(rtn, SourceName):
+                        names[source] = rtn.name
+            return names
+
+        def dump_capture(self, path: str = None):
+            if self.capture is None:
+                return None
+            return self.capture.dump(path, model=self.profile.name, port=self._port_url)
+
+        async def close(self):
+            self._reader_task.cancel()
+            self._writer.close()
+            self.dump_capture()
+
+    loop = loop or asyncio.get_running_loop()
+    _LOGGER.debug('Attempting connection - "%s"', port_url)
+    reader, writer = await open_serial_connection(
+        loop=loop,
+        url=port_url,
+        baudrate=57600,
+        stopbits=serial.STOPBITS_ONE,
+        bytesize=serial.EIGHTBITS,
+        parity=serial.PARITY_NONE,
+        timeout=TIMEOUT_OP,
+        write_timeout=TIMEOUT_OP)
+    return NuvoAsync(port_url, reader, writer, loop, retry_policy, cache_ttl, model, capture)
 
 
 #************************************************************************************************************************************************************************************
 
 """Support for interfacing with Nuvo Multi-Zone Amplifier via serial/RS-232."""
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import logging
+from types import MappingProxyType
 
 import voluptuous as vol
 
 from homeassistant.components.media_player import MediaPlayerEntity, PLATFORM_SCHEMA
 from homeassistant.components.media_player.const import (
+    ATTR_INPUT_SOURCE,
+    ATTR_MEDIA_VOLUME_LEVEL,
     DOMAIN,
     SUPPORT_SELECT_SOURCE,
     SUPPORT_TURN_OFF,
@@ -525,10 +2111,14 @@ from homeassistant.const import (
     ATTR_ENTITY_ID,
     CONF_NAME,
     CONF_PORT,
+    EVENT_HOMEASSISTANT_STOP,
     STATE_OFF,
     STATE_ON,
 )
 import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers.discovery import load_platform
+from homeassistant.helpers.event import track_time_interval
+from homeassistant.helpers.storage import Store
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -547,11 +2137,48 @@ SOURCE_SCHEMA = vol.Schema({
 CONF_ZONES = 'zones'
 CONF_SOURCES = 'sources'
 CONF_MODEL = 'model'
+CONF_CONTROLLERS = 'controllers'
+CONF_CAPTURE = 'capture'
 
 DATA_NUVO = 'nuvo'
+# dict port -> NuvoStatusCoordinator, for the diagnostics sensors
+DATA_NUVO_CONTROLLERS = 'nuvo_controllers'
+NUVO_DOMAIN = 'nuvo'
+
+# Every tick the coordinator sweeps the zones that are due, each zone on an
+# interval that follows its activity. Keypad changes are pushed by the
+# amplifier, so polling is only a safety net.
+POLL_TICK = datetime.timedelta(seconds=1)
+# Seconds between polls of a zone commanded or changed within ACTIVITY_WINDOW
+POLL_ACTIVE_INTERVAL = 5.0
+# Seconds between polls of a quiet zone that is on, or has not answered yet
+POLL_IDLE_INTERVAL = 60.0
+# Seconds between polls of a zone that is off
+POLL_OFF_INTERVAL = 300.0
+ACTIVITY_WINDOW = 120.0
+
+ATTR_DIAGNOSTICS = 'diagnostics'
+
+# Seconds the startup sweep may hold up the platform setup
+DISCOVERY_TIMEOUT = 3.0
+
+# Seconds an unconfirmed command keeps its value shown over polled status
+OPTIMISTIC_TIMEOUT = 5.0
+
+# One dB of the amplifier's 78 dB range, in status volume percent
+VOLUME_STEP = 100 / 78
+
+# Source names read from the amplifiers, kept between restarts
+STORAGE_KEY = 'nuvo.sources'
+STORAGE_VERSION = 1
+STORAGE_SAVE_DELAY = 5
 
 SERVICE_SNAPSHOT = 'snapshot'
 SERVICE_RESTORE = 'restore'
+SERVICE_ALL_OFF = 'nuvo_all_off'
+SERVICE_GROUP_SOURCE = 'nuvo_group_source'
+SERVICE_GROUP_VOLUME = 'nuvo_group_volume'
+SERVICE_DUMP_CAPTURE = 'nuvo_dump_capture'
 
 # Valid zone ids: 1-12
 ZONE_IDS = vol.All(vol.Coerce(int), vol.Any(
@@ -562,43 +2189,130 @@ SOURCE_IDS = vol.All(vol.Coerce(int), vol.Range(min=1, max=6))
 
 MEDIA_PLAYER_SCHEMA = vol.Schema({ATTR_ENTITY_ID: cv.comp_entity_ids})
 
-PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
+GROUP_SOURCE_SCHEMA = MEDIA_PLAYER_SCHEMA.extend({
+    vol.Required(ATTR_INPUT_SOURCE): cv.string,
+})
+
+GROUP_VOLUME_SCHEMA = MEDIA_PLAYER_SCHEMA.extend({
+    vol.Required(ATTR_MEDIA_VOLUME_LEVEL): cv.small_float,
+})
+
+# One amplifier, i.e. port: socket://192.168.1.20:4001 for a network serial bridge
+CONTROLLER_SCHEMA = vol.Schema({
     vol.Required(CONF_PORT): cv.string,
     vol.Required(CONF_ZONES): vol.Schema({ZONE_IDS: ZONE_SCHEMA}),
-    vol.Required(CONF_SOURCES): vol.Schema({SOURCE_IDS: SOURCE_SCHEMA}),
+    vol.Optional(CONF_SOURCES): vol.Schema({SOURCE_IDS: SOURCE_SCHEMA}),
     vol.Optional(CONF_MODEL): cv.string,
+    # File, relative to the configuration directory, the serial traffic is captured to
+    vol.Optional(CONF_CAPTURE): cv.string,
 })
 
+# Sources the amplifier is asked to name
+SOURCE_RANGE = range(1, 7)
+
+PLATFORM_SCHEMA = vol.All(PLATFORM_SCHEMA.extend({
+    vol.Inclusive(CONF_PORT, 'controller'): cv.string,
+    vol.Inclusive(CONF_ZONES, 'controller'): vol.Schema({ZONE_IDS: ZONE_SCHEMA}),
+    vol.Optional(CONF_SOURCES, default={}): vol.Schema({SOURCE_IDS: SOURCE_SCHEMA}),
+    vol.Optional(CONF_MODEL): cv.string,
+    vol.Optional(CONF_CAPTURE): cv.string,
+    vol.Optional(CONF_CONTROLLERS): vol.All(cv.ensure_list, [CONTROLLER_SCHEMA]),
+}), cv.has_at_least_one_key(CONF_PORT, CONF_CONTROLLERS))
+
+
+def _same_state(attr, value, expected):
+    """Return True if a status value confirms an optimistic one."""
+    if attr == '_volume':
+        # The amplifier rounds to whole dB
+        return (value is not None and expected is not None
+                and abs(value - expected) <= VOLUME_STEP)
+    return value == expected
+
+def _fan_out(func, items):
+    """Run func on every item at the same time, one thread per item."""
+    items = list(items)
+    if len(items) < 2:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=len(items)) as executor:
+        return list(executor.map(func, items))
+
 def setup_platform(hass, config, add_entities, discovery_info=None):
     """Set up the Nuvo multi zone amplifier platform."""
-    port = config.get(CONF_PORT)
+    controllers = list(config.get(CONF_CONTROLLERS, []))
+    if CONF_PORT in config:
+        controller = {CONF_PORT: config[CONF_PORT], CONF_ZONES: config[CONF_ZONES]}
+        if CONF_CAPTURE in config:
+            controller[CONF_CAPTURE] = config[CONF_CAPTURE]
+        controllers.insert(0, controller)
 
     from serial import SerialException
 #    from pynuvo import get_nuvo
-    try:
-        nuvo = get_nuvo(port)
-    except SerialException:
-        _LOGGER.error("Error connecting to Nuvo controller")
-        return
 
-    sources = {source_id: extra[CONF_NAME] for source_id, extra
-               in config[CONF_SOURCES].items()}
+    # dict port -> {source id: name} read from the amplifiers, shared by the catalogs
+    store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+    cached_names = asyncio.run_coroutine_threadsafe(
+        store.async_load(), hass.loop).result() or {}
+
+    # Each controller is its own lane: its own port, reader thread, lock
+    # and coordinator, so commands to different amplifiers run in parallel
+    lanes = []
+    hass.data[DATA_NUVO_CONTROLLERS] = {}
+    for controller in controllers:
+        port = controller[CONF_PORT]
+        try:
+            # Without a model the profile is detected from the first response
+            capture = controller.get(CONF_CAPTURE)
+            nuvo = get_nuvo(port, model=controller.get(CONF_MODEL, config.get(CONF_MODEL)),
+                            capture=capture and hass.config.path(capture))
+        except SerialException:
+            _LOGGER.error("Error connecting to Nuvo controller on %s", port)
+            continue
+
+        sources = {source_id: extra[CONF_NAME] for source_id, extra
+                   in controller.get(CONF_SOURCES, config[CONF_SOURCES]).items()}
+
+        _LOGGER.debug("Configured sources on %s: %s", port, sources)
+
+        catalog = NuvoSourceCatalog(hass, store, cached_names, nuvo, port, sources)
+
+        hass.bus.listen_once(EVENT_HOMEASSISTANT_STOP,
+                             lambda event, nuvo=nuvo: nuvo.close())
+
+        coordinator = NuvoStatusCoordinator(nuvo, controller[CONF_ZONES].keys())
+        lanes.append((coordinator, catalog, controller[CONF_ZONES]))
+        hass.data[DATA_NUVO_CONTROLLERS][port] = coordinator
+
+    if not lanes:
+        return
 
-    _LOGGER.warning("Number of sources is " + str(len(sources)))
-    for i in range(1, (len(sources)+1)):
-        _LOGGER.warning("trying to get source " + str(i))
-        _LOGGER.warning("Sources list at " + str(i) + " is " + str(sources[i]))
+    # One time-boxed sweep seeds the entities, a dead or unconfigured zone
+    # does not hold up the setup with its retries. Controllers are swept
+    # at the same time
+    _fan_out(lambda lane: lane[0].refresh(timeout=DISCOVERY_TIMEOUT), lanes)
 
     hass.data[DATA_NUVO] = []
-    for zone_id, extra in config[CONF_ZONES].items():
-        _LOGGER.info("Adding zone %d - %s", zone_id, extra[CONF_NAME])
-        hass.data[DATA_NUVO].append(NuvoZone(
-            nuvo, sources, zone_id, extra[CONF_NAME]))
-
-    add_entities(hass.data[DATA_NUVO], True)
+    for coordinator, catalog, zones in lanes:
+        coordinator.nuvo.add_status_listener(coordinator.handle_push)
+        coordinator.nuvo.add_source_listener(catalog.handle_name)
+        for zone_id, extra in zones.items():
+            _LOGGER.info("Adding zone %d - %s", zone_id, extra[CONF_NAME])
+            device = NuvoZone(coordinator.nuvo, coordinator, catalog, zone_id, extra[CONF_NAME])
+            device.update()
+            hass.data[DATA_NUVO].append(device)
+
+    add_entities(hass.data[DATA_NUVO])
+    # Transport and polling diagnostics, one sensor per controller
+    load_platform(hass, 'sensor', NUVO_DOMAIN, {}, config)
+
+    for coordinator, catalog, _ in lanes:
+        # Names come from the cache, the amplifiers are only asked the first
+        # time and the entities are renamed by the catalog when they arrive
+        hass.add_job(catalog.load)
+        # Zones that missed the sweep are filled in once HA is running
+        hass.add_job(coordinator.refresh_missing)
+        track_time_interval(hass, coordinator.poll, POLL_TICK)
 
     def service_handle(service):
-        _LOGGER.warning("service_handle")
         """Handle for services."""
         entity_ids = service.data.get(ATTR_ENTITY_ID)
 
@@ -608,11 +2322,31 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
         else:
             devices = hass.data[DATA_NUVO]
 
+        by_coordinator = {}
         for device in devices:
-            if service.service == SERVICE_SNAPSHOT:
-                device.snapshot()
-            elif service.service == SERVICE_RESTORE:
-                device.restore()
+            by_coordinator.setdefault(device.coordinator, []).append(device)
+
+        # Each controller gets one batch, the controllers run in parallel
+        if service.service == SERVICE_SNAPSHOT:
+            _fan_out(lambda item: item[0].snapshot(item[1]), by_coordinator.items())
+        elif service.service == SERVICE_RESTORE:
+            _fan_out(lambda item: item[0].restore(item[1]), by_coordinator.items())
+        elif service.service == SERVICE_ALL_OFF:
+            _fan_out(lambda item: item[0].all_off(item[1]), by_coordinator.items())
+        elif service.service == SERVICE_GROUP_SOURCE:
+            source = service.data[ATTR_INPUT_SOURCE]
+            _fan_out(lambda item: item[0].set_group_source(item[1], source),
+                     by_coordinator.items())
+        elif service.service == SERVICE_GROUP_VOLUME:
+            volume = service.data[ATTR_MEDIA_VOLUME_LEVEL]
+            _fan_out(lambda item: item[0].set_group_volume(item[1], volume),
+                     by_coordinator.items())
+        elif service.service == SERVICE_DUMP_CAPTURE:
+            for coordinator in by_coordinator:
+                frames = coordinator.nuvo.dump_capture()
+                if frames is not None:
+                    _LOGGER.info("Wrote %d captured frames to %s",
+                                 frames, coordinator.nuvo.capture.path)
 
     hass.services.register(
         DOMAIN, SERVICE_SNAPSHOT, service_handle, schema=MEDIA_PLAYER_SCHEMA)
@@ -620,29 +2354,282 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
     hass.services.register(
         DOMAIN, SERVICE_RESTORE, service_handle, schema=MEDIA_PLAYER_SCHEMA)
 
+    hass.services.register(
+        DOMAIN, SERVICE_ALL_OFF, service_handle, schema=MEDIA_PLAYER_SCHEMA)
+
+    hass.services.register(
+        DOMAIN, SERVICE_GROUP_SOURCE, service_handle, schema=GROUP_SOURCE_SCHEMA)
+
+    hass.services.register(
+        DOMAIN, SERVICE_GROUP_VOLUME, service_handle, schema=GROUP_VOLUME_SCHEMA)
+
+    hass.services.register(
+        DOMAIN, SERVICE_DUMP_CAPTURE, service_handle, schema=MEDIA_PLAYER_SCHEMA)
+
+
+# Immutable source index of a controller, shared by all its zones
+SourceIndex = collections.namedtuple('SourceIndex', ['id_name', 'name_id', 'names'])
+
+
+def _source_index(names):
+    """Build a SourceIndex from a dict source id -> name."""
+    id_name = dict(sorted(names.items()))
+    return SourceIndex(MappingProxyType(id_name),
+                       MappingProxyType({name: source_id for source_id, name in id_name.items()}),
+                       tuple(id_name.values()))
+
+
+class NuvoSourceCatalog(object):
+    """Source names of a controller: configured, read from it and cached."""
+
+    def __init__(self, hass, store, cached_names, nuvo, port, configured):
+        """Initialize the catalog."""
+        self._hass = hass
+        self._store = store
+        # dict port -> {source id as str: name}, the whole store
+        self._cached_names = cached_names
+        self._nuvo = nuvo
+        self._port = port
+        # Names in the configuration win over the ones the amplifier reports
+        self._configured = dict(configured)
+        self._discovered = {int(source_id): name for source_id, name
+                            in cached_names.get(port, {}).items()}
+        self._listeners = []
+        self.index = _source_index({**self._discovered, **self._configured})
+
+    def load(self):
+        """Read the names from the amplifier unless they are cached."""
+        if self._discovered:
+            return
+        # An amplifier that doesn't answer name requests costs one time-box
+        names = self._nuvo.source_names(
+            [source_id for source_id in SOURCE_RANGE if source_id not in self._configured],
+            timeout=DISCOVERY_TIMEOUT)
+        if names:
+            _LOGGER.debug("Source names on %s: %s", self._port, names)
+            self._discovered.update(names)
+            self._publish()
+
+    def handle_name(self, source_name):
+        """Apply a source name frame the amplifier sent on its own."""
+        if self._discovered.get(source_name.source) == source_name.name:
+            return
+        self._discovered[source_name.source] = source_name.name
+        self._publish()
+
+    def add_listener(self, listener):
+        """Call listener when the index changes, return a remover."""
+        self._listeners.append(listener)
+        return lambda: self._listeners.remove(listener)
+
+    def _publish(self):
+        # A new index replaces the old one, readers never see it half built
+        self.index = _source_index({**self._discovered, **self._configured})
+        self._cached_names[self._port] = {
+            str(source_id): name for source_id, name in self._discovered.items()}
+        self._hass.add_job(self._store.async_delay_save,
+                           lambda: self._cached_names, STORAGE_SAVE_DELAY)
+        for listener in list(self._listeners):
+            listener()
+
+
+class NuvoStatusCoordinator(object):
+    """Polls the configured zones in shared sweeps and shares the snapshot."""
+
+    def __init__(self, nuvo, zone_ids):
+        """Initialize the coordinator."""
+        self.nuvo = nuvo
+        self._zone_ids = list(zone_ids)
+        # dict zone_id -> callbacks run when the zone status is published
+        self._listeners = {}
+        # dict zone_id -> last ZoneStatus received for the zone
+        self.data = {}
+        # dict zone_id -> time.monotonic() of the last command to or change of the zone
+        self._activity = {}
+        # dict zone_id -> time.monotonic() the zone is next polled
+        self._due = {}
+        # dict zone_id -> number of polls of the zone
+        self._polls = collections.Counter()
+        self._started = time.monotonic()
+        # Held by the tick that is sweeping, an overlapping tick is skipped
+        self._polling = Lock()
+
+    def add_listener(self, zone_id, listener):
+        """Call listener on new status for zone_id, return a remover."""
+        self._listeners.setdefault(zone_id, []).append(listener)
+        return lambda: self._listeners[zone_id].remove(listener)
+
+    def _notify(self, zone_ids):
+        for zone_id in zone_ids:
+            for listener in list(self._listeners.get(zone_id, ())):
+                listener()
+
+    def refresh(self, now=None, timeout=None):
+        """Sweep every zone and notify the listeners."""
+        self._sweep(self._zone_ids, timeout)
+
+    def poll(self, now=None):
+        """Sweep the zones that are due."""
+        if not self._polling.acquire(blocking=False):
+            return
+        try:
+            at = time.monotonic()
+            zone_ids = [zone_id for zone_id in self._zone_ids
+                        if self._due.get(zone_id, at) <= at]
+            if zone_ids:
+                self._sweep(zone_ids, None)
+        finally:
+            self._polling.release()
+
+    def mark_active(self, zone_id):
+        """Poll a zone that was just commanded on the active interval."""
+        at = time.monotonic()
+        self._activity[zone_id] = at
+        self._due[zone_id] = min(self._due.get(zone_id, at), at + POLL_ACTIVE_INTERVAL)
+
+    def _interval(self, zone_id, at):
+        """Seconds between polls of a zone, from its activity and status."""
+        if at - self._activity.get(zone_id, -ACTIVITY_WINDOW) < ACTIVITY_WINDOW:
+            return POLL_ACTIVE_INTERVAL
+        status = self.data.get(zone_id)
+        if status is None or status.power:
+            return POLL_IDLE_INTERVAL
+        return POLL_OFF_INTERVAL
+
+    def schedule(self):
+        """Return the polling schedule of the zones, for diagnostics."""
+        at = time.monotonic()
+        elapsed = max(at - self._started, 1.0)
+        intervals = {zone_id: self._interval(zone_id, at) for zone_id in self._zone_ids}
+        return {
+            'zones': {zone_id: {'interval_s': interval,
+                                'due_in_s': round(max(self._due.get(zone_id, at) - at, 0.0), 1),
+                                'polls': self._polls[zone_id]}
+                      for zone_id, interval in intervals.items()},
+            'polls_per_minute': round(sum(60 / interval for interval in intervals.values()), 1),
+            'measured_polls_per_minute': round(sum(self._polls.values()) * 60 / elapsed, 1),
+        }
+
+    def refresh_missing(self):
+        """Sweep the zones that have no status yet, with retries."""
+        # Waits for a poll tick in progress rather than sweeping the same zones
+        with self._polling:
+            zone_ids = [zone_id for zone_id in self._zone_ids if zone_id not in self.data]
+            if zone_ids:
+                _LOGGER.debug("Filling in zones %s", zone_ids)
+                self._sweep(zone_ids, None)
+
+    def _sweep(self, zone_ids, timeout):
+        # Zones answered from the status cache cost nothing on the wire
+        polled = []
+        # Polls yield the port to user commands and to snapshot/restore
+        with self.nuvo.priority(PRIORITY_POLL):
+            statuses = self.nuvo.zone_statuses(zone_ids, timeout=timeout, sent=polled)
+        # A zone that did not answer keeps its last known status
+        data = dict(self.data)
+        at = time.monotonic()
+        for zone_id, status in statuses.items():
+            if status is None:
+                continue
+            previous = data.get(zone_id)
+            if previous is not None and status.diff(previous):
+                self._activity[zone_id] = at
+            data[zone_id] = status
+        self.data = data
+        for zone_id in polled:
+            self._polls[zone_id] += 1
+        for zone_id in zone_ids:
+            self._due[zone_id] = at + self._interval(zone_id, at)
+        self._notify(zone_ids)
+
+    def snapshot(self, devices):
+        """Save the current state of the zones of devices in one sweep."""
+        with self.nuvo.priority(PRIORITY_BULK):
+            statuses = self.nuvo.zone_statuses([device.zone_id for device in devices])
+        for device in devices:
+            device.snapshot(statuses.get(device.zone_id))
+
+    def restore(self, devices):
+        """Restore the saved state of the zones of devices in one batch."""
+        statuses = self.nuvo.restore_zones(
+            [device.snapshot_status for device in devices])
+        self._publish(statuses)
+
+    def all_off(self, devices):
+        """Turn the zones of devices off."""
+        zone_ids = [device.zone_id for device in devices]
+        if set(zone_ids) >= set(self._zone_ids):
+            # The all-zone command switches off the whole amplifier, every
+            # configured zone is published off with it
+            self._publish(self.nuvo.all_off(self._zone_ids, all_zones=True))
+        else:
+            self._publish(self.nuvo.all_off(zone_ids))
+
+    def set_group_source(self, devices, source):
+        """Switch the zones of devices to the source named source."""
+        source_id = devices[0].catalog.index.name_id.get(source)
+        if source_id is None:
+            _LOGGER.warning("Unknown source %s on %s", source, devices[0].name)
+            return
+        self._publish(self.nuvo.set_group_source(
+            [device.zone_id for device in devices], source_id))
+
+    def set_group_volume(self, devices, volume):
+        """Set the zones of devices to a volume level, range 0..1."""
+        # Same scale as NuvoZone.set_volume_level
+        self._publish(self.nuvo.set_group_volume(
+            [device.zone_id for device in devices], (volume - 1) * 100))
+
+    def _publish(self, statuses):
+        for zone_id, status in statuses.items():
+            self.mark_active(zone_id)
+            self.update_zone(zone_id, status)
+
+    def update_zone(self, zone_id, status):
+        """Publish a status received outside of a sweep."""
+        if status is None:
+            return
+        previous = self.data.get(zone_id)
+        if previous is not None and status.diff(previous):
+            self.mark_active(zone_id)
+        data = dict(self.data)
+        data[zone_id] = status
+        self.data = data
+        self._notify((zone_id,))
+
+    def handle_push(self, status):
+        """Publish a status frame the amplifier sent on its own."""
+        zone_id = int(status.zone)
+        if zone_id in self._zone_ids:
+            self.update_zone(zone_id, status)
+            # Someone is at the keypad. The frame is a full status, so there
+            # is nothing to read now, only more changes to expect
+            self.mark_active(zone_id)
+
 
 class NuvoZone(MediaPlayerEntity):
     """Representation of a Nuvo amplifier zone."""
 
-    def __init__(self, nuvo, sources, zone_id, zone_name):
+    _attr_should_poll = False
+
+    def __init__(self, nuvo, coordinator, catalog, zone_id, zone_name):
         """Initialize new zone."""
-        _LOGGER.warning("Nuvozone init for zone " + str(zone_id))
         self._nuvo = nuvo
-        # dict source_id -> source name
-        self._source_id_name = sources
-        # dict source name -> source_id
-        self._source_name_id = {v: k for k, v in sources.items()}
-        # ordered list of all source names
-        self._source_names = sorted(self._source_name_id.keys(),
-                                    key=lambda v: self._source_name_id[v])
+        self._coordinator = coordinator
+        # source names of the controller, its index is shared by all zones
+        self._catalog = catalog
         self._zone_id = zone_id
         self._name = zone_name
 
         self._snapshot = None
+        # last ZoneStatus applied to the entity
+        self._status = None
         self._state = STATE_OFF
         self._volume = None
         self._source = None
         self._mute = None
+        # dict attribute -> (value, deadline) of commands the amplifier has not confirmed
+        self._pending = {}
         self._last_update = datetime.datetime.now()
         #_LOGGER.warning("sending status request from init for zone " + str(zone_id))
         #rtn = ZoneStatus.from_string(self._nuvo._process_request(_format_zone_status_request(zone_id), False))
@@ -652,55 +2639,98 @@ class NuvoZone(MediaPlayerEntity):
         #    _LOGGER.warning("done in init, source is " + str(rtn.source))
         #    _LOGGER.warning("done in init, volume is " + str(rtn.volume))
 
+    async def async_added_to_hass(self):
+        """Follow the status sweeps of the coordinator."""
+        self.async_on_remove(
+            self._coordinator.add_listener(
+                self._zone_id, self._handle_coordinator_update))
+        self.async_on_remove(
+            self._catalog.add_listener(self._handle_catalog_update))
+        # Catch up on a fill-in sweep that finished before the entity was added
+        self.update()
+
+    def _handle_coordinator_update(self):
+        """Apply the latest sweep, write the state only if it changed."""
+        if self.update():
+            self.schedule_update_ha_state()
+
+    def _handle_catalog_update(self):
+        """Rename the current source and the source list."""
+        if self._status is not None:
+            self._source = self._source_name(self._status.source)
+        self.schedule_update_ha_state()
+
+    def _source_name(self, source):
+        if source == "None":
+            return None
+        return self._catalog.index.id_name.get(int(source))
+
     def update(self):
-        """Retrieve latest state."""
-        _LOGGER.warning("Nuvozone update for zone " + str(self._zone_id))
-        _LOGGER.warning("Calling zonestatus from update for " + str(self._zone_id))
-        state = self._nuvo.zone_status(self._zone_id)
-        _LOGGER.warning("NuvoZone Update back from Zone_status")
-        if not state:
-            _LOGGER.warning("not state is true, exiting update")
+        """Retrieve latest state from the coordinator snapshot."""
+        state = self._coordinator.data.get(self._zone_id)
+        if not state or not state.diff(self._status):
             return False
-        _LOGGER.warning("power is " + str(state.power) + " volume is " + str(state.volume) + " mute is " + str(state.mute))
-        _LOGGER.warning("source is " + str(state.source))
-        self._state = STATE_ON if state.power else STATE_OFF
-        self._volume = state.volume
-        self._mute = state.mute
-        
-        if (not (state.source == "None")):
-            self._source = str(self._source_id_name[int(state.source)])
-            _LOGGER.warning("update - setting source name to " + str(self._source_id_name[int(state.source)]))
-        else:
-            self._source = None
-            _LOGGER.warning("update - Unable to find source name, setting to none")
-            
-        _LOGGER.warning("done in update")
-        return True
+        self._status = state
+        if _TRACE():
+            _LOGGER.debug("Zone %s power %s volume %s mute %s source %s", self._zone_id,
+                          state.power, state.volume, state.mute, state.source)
+        return self._apply(state)
 
-    @classmethod
-    def update_info(self, update_object, destination_object):
-        """ updates the HA settings with what was recieved"""
-        if not update_object.power == None:
-            _LOGGER.warning("Setting Power to " + str(update_object.power))
-            self._state = update_object.power
-        if not update_object.volume == None:
-            _LOGGER.warning("Setting volume to " + str(update_object.volume))
-            self._volume = update_object.volume
-        if not update_object.source == None:
-            _LOGGER.warning("Source ID is " + str(update_object.source))
-            idx = update_object.source
-            if idx in destination_object._source_id_name:
-                self._source = destination_object._source_id_name[idx]
-                _LOGGER.warning("update_info - found sourcename " + str(destination_object._source_id_name[idx]))
-            else:
-                _LOGGER.warning("update_info - unable to find source Name")
+    def _apply(self, status, settled=()):
+        """
+        Copy a status onto the entity. An attribute with a command in flight
+        keeps its optimistic value until the status confirms it, the command
+        settles or its deadline passes, then the status wins.
+        """
+        now = time.monotonic()
+        changed = False
+        for attr, value in (('_state', STATE_ON if status.power else STATE_OFF),
+                            ('_volume', status.volume),
+                            ('_mute', status.mute),
+                            ('_source', self._source_name(status.source))):
+            if attr == '_volume' and (status.mute or not status.power):
+                # A muted or off zone doesn't report its volume, the last known one stands
+                continue
+            pending = self._pending.get(attr)
+            if pending is not None:
+                if _same_state(attr, value, pending[0]):
+                    self._pending.pop(attr, None)
+                elif attr in settled or pending[1] <= now:
+                    self._pending.pop(attr, None)
+                    _LOGGER.debug("Zone %s %s rolled back from %s to %s",
+                                  self._zone_id, attr[1:], pending[0], value)
+                else:
+                    continue
+            if getattr(self, attr) != value:
+                setattr(self, attr, value)
+                changed = True
+        return changed
+
+    def _command(self, attr, value, command, *args):
+        """
+        Show value at once, then send the command and reconcile the entity
+        with the status the amplifier answers, or the last known one if it
+        does not answer.
+        """
+        pending = (value, time.monotonic() + OPTIMISTIC_TIMEOUT)
+        self._pending[attr] = pending
+        self._coordinator.mark_active(self._zone_id)
+        setattr(self, attr, value)
+        self.schedule_update_ha_state()
+
+        status = command(self._zone_id, *args)
+        if status is not None:
+            self._coordinator.update_zone(self._zone_id, status)
         else:
-            self._source = None
-            _LOGGER.warning("source name is  " + self._nuvo._source_id-name[update_object.source])
-            self._source = self._nuvo._source_id-name[update_object.source]
-        if not update_object.mute == None:
-            _LOGGER.warning("Setting mute to " + str(update_object.mute))
-            self._mute = update_object.mute
+            status = self._status
+        # A newer command on the same attribute settles it instead
+        settled = (attr,) if self._pending.get(attr) is pending else ()
+        if status is None:
+            if settled:
+                self._pending.pop(attr, None)
+            return
+        if self._apply(status, settled):
+            self.schedule_update_ha_state()
 
     @property
     def name(self):
@@ -717,7 +2747,7 @@ class NuvoZone(MediaPlayerEntity):
         """Volume level of the media player (0..1)."""
         if self._volume is None:
             return None
-        return (( int(self._volume) + 78) / 78)
+        return self._volume / 100
 
     @property
     def is_volume_muted(self):
@@ -742,64 +2772,74 @@ class NuvoZone(MediaPlayerEntity):
     @property
     def source_list(self):
         """List of available input sources."""
-        return self._source_names
+        return list(self._catalog.index.names)
 
-    def snapshot(self):
+    @property
+    def zone_id(self):
+        """Return the zone number on the controller."""
+        return self._zone_id
+
+    @property
+    def coordinator(self):
+        """Return the coordinator of the zone's controller."""
+        return self._coordinator
+
+    @property
+    def catalog(self):
+        """Return the source catalog of the zone's controller."""
+        return self._catalog
+
+    @property
+    def snapshot_status(self):
+        """Return the saved zone state, None if there is none."""
+        return self._snapshot
+
+    def snapshot(self, status=None):
         """Save zone's current state."""
-        _LOGGER.warning("Calling Zone_Status from Snapshot for zone " + str(self._zone_id))
-        self._snapshot = self._nuvo.zone_status(self._zone_id)
-        _LOGGER.warning("Back in snapshot")
+        self._snapshot = status or self._nuvo.zone_status(self._zone_id)
 
     def restore(self):
         """Restore saved state."""
         if self._snapshot:
-            self._nuvo.restore_zone(self._snapshot)
-            self.schedule_update_ha_state(True)
+            self._coordinator.update_zone(
+                self._zone_id, self._nuvo.restore_zone(self._snapshot))
 
     def select_source(self, source):
         """Set input source."""
-        if source not in self._source_name_id:
+        idx = self._catalog.index.name_id.get(source)
+        if idx is None:
             return
-        idx = self._source_name_id[source]
-        rtn = self._nuvo.set_source(self._zone_id, idx)
-        self.update_info(rtn, self)
+        self._command('_source', source, self._nuvo.set_source, idx)
 
     def turn_on(self):
         """Turn the media player on."""
-        _LOGGER.warning("attempting to turn on zone " + str(self._zone_id))
-        rtn = self._nuvo.set_power(self._zone_id, True)
-        _LOGGER.warning("back in turn on, got rtn = " + str(rtn))
-        self.update_info(rtn, self)
+        self._command('_state', STATE_ON, self._nuvo.set_power, True)
 
     def turn_off(self):
         """Turn the media player off."""
-        _LOGGER.warning("attempting to turn off zone " + str(self._zone_id))
-        rtn = self._nuvo.set_power(self._zone_id, False)
-        _LOGGER.warning("returned to turn off, got rtn = " + str(rtn))
-        self.update_info(rtn, self)
+        self._command('_state', STATE_OFF, self._nuvo.set_power, False)
 
     def mute_volume(self, mute):
         """Mute (true) or unmute (false) media player."""
-        rtn = self._nuvo.set_mute(self._zone_id, mute)
-        self.update_info(rtn, self)
+        self._command('_mute', bool(mute), self._nuvo.set_mute, mute)
 
     def set_volume_level(self, volume):
         """Set volume level, range 0..1."""
-        _LOGGER.warning("attempting to set Zone " + str(self._zone_id) + " volume to " + str(volume))
-        rtn = self._nuvo.set_volume(self._zone_id, int( (volume * 78) - 78) )
-        self.update_info(rtn, self)
+        self._set_volume(volume * 100)
 
     def volume_up(self):
         """Volume up the media player."""
         if self._volume is None:
             return
-        rtn = self._nuvo.set_volume(self._zone_id, min(self._volume + 1, 0))
-        self.update_info(rtn, self)
+        self._set_volume(min(self._volume + VOLUME_STEP, 100))
 
     def volume_down(self):
         """Volume down media player."""
         if self._volume is None:
             return
-        rtn = self._nuvo.set_volume(self._zone_id, max(self._volume - 1, -78))
-        self.update_info(rtn, self)
+        self._set_volume(max(self._volume - VOLUME_STEP, 0))
+
+    def _set_volume(self, percent):
+        # The amplifier takes the attenuation, i.e. the distance from full volume
+        self._command('_volume', percent, self._nuvo.set_volume, percent - 100)
 
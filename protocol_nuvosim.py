@@ -0,0 +1,422 @@
+"""
+In-process Nuvo amplifier emulator, reachable through serial.serial_for_url
+
+Importing this module registers the nuvosim:// URL scheme, i.e.
+    nuvo = get_nuvo('nuvosim://essentia?zones=12&busy=0.02&keypad=0.5')
+
+URL options:
+    host        essentia (default) or concerto, the response format
+    zones       number of zones that answer, 1-20 (1-9 on a Concerto)
+    delay       seconds the amplifier takes to process a command
+    latency     1 (default) to pace bytes at the port baudrate, 0 for none
+    busy        probability a command is answered with #Busy
+    backlog     commands the amplifier queues, one arriving on a full queue
+                is answered #Busy; 0 (default) queues any number
+    keypad      unsolicited keypad changes per second
+    drop        probability each response byte is lost
+    seed        seed of the random source, for repeatable runs
+"""
+import collections
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse as urlparse
+
+import serial
+from serial.serialutil import (PortNotOpenError, SerialBase, SerialException,
+                               to_bytes)
+
+SCHEME = 'nuvosim'
+
+MODELS = ('essentia', 'concerto')
+
+EOL = b'\r'
+
+# Attenuation in dB, 0 is the loudest and 79 the quietest setting
+VOLUME_MAX_ATTENUATION = 79
+
+# Values are whole numbers, anything else is answered #?
+_COMMAND = re.compile(r'Z(?P<zone>\d{1,2})(?P<operation>[A-Z?]+)(?P<value>-?\d*)$')
+
+
+class _ZoneState(object):
+    __slots__ = ('power', 'source', 'volume', 'mute', 'treble', 'bass')
+
+    def __init__(self):
+        self.power = False
+        self.source = 1
+        self.volume = 40
+        self.mute = False
+        self.treble = 0
+        self.bass = 0
+
+
+class NuvoEmulator(object):
+    """
+    Model of the amplifier: per-zone state and the response to each command,
+    independent of any timing
+    """
+
+    def __init__(self, model='essentia', zones=12, busy=0.0, rng=None):
+        if model not in MODELS:
+            raise ValueError('unknown model: {!r}'.format(model))
+        self.model = model
+        self.zones = {zone: _ZoneState() for zone in range(1, zones + 1)}
+        self.busy = busy
+        self.rng = rng or random.Random()
+        # source id -> name, only a Concerto reports them
+        self.source_names = {source: 'SOURCE {}'.format(source) for source in range(1, 7)}
+        # every command received, without framing
+        self.commands = []
+
+    def frame(self, zone: int) -> bytes:
+        """
+        :param zone: zone id
+        :return: status frame of the zone as the amplifier sends it
+        """
+        state = self.zones[zone]
+        if self.model == 'concerto':
+            volume = 'MT' if state.mute else '-{:02d}'.format(state.volume)
+            return 'Z0{}PWR{},SRC{},VOL{}'.format(
+                zone, 'ON' if state.power else 'OFF', state.source, volume).encode()
+        if not state.power:
+            return '#Z{},OFF'.format(zone).encode()
+        volume = 'MUTE' if state.mute else '{:02d}'.format(state.volume)
+        return '#Z{},ON,SRC{},VOL{},DND0,LOCK0'.format(zone, state.source, volume).encode()
+
+    def handle(self, line: bytes):
+        """
+        :param line: command line without EOL, i.e. b'*Z3VOL40'
+        :return: response frame or None if the amplifier stays silent
+        """
+        command = line.decode('ascii', 'replace').strip().lstrip('*')
+        self.commands.append(command)
+        if self.busy and self.rng.random() < self.busy:
+            return b'#Busy'
+        if command in ('ALLOFF', 'ALLMON', 'ALLMOFF'):
+            for state in self.zones.values():
+                if command == 'ALLOFF':
+                    state.power = False
+                else:
+                    state.mute = command == 'ALLMON'
+            return '#{}'.format(command).encode()
+        match = _COMMAND.match(command)
+        if match is None:
+            return b'#?'
+        zone = int(match.group('zone'))
+        if match.group('operation') == 'STR?' and self.model == 'concerto':
+            # Z0xSTR? asks for the name of source x
+            return self.source_name(zone) if zone in self.source_names else b'#?'
+        if zone not in self.zones:
+            # An absent zone answers nothing, the host times out
+            return None
+        state = self.zones[zone]
+        operation, value = match.group('operation', 'value')
+        if operation == 'STATUS?':
+            pass
+        elif operation == 'ON' and not value:
+            state.power = True
+        elif operation == 'OFF' and not value:
+            state.power = False
+        elif operation == 'MTON' and not value:
+            state.mute = True
+        elif operation == 'MTOFF' and not value:
+            state.mute = False
+        elif operation == 'VOL' and value:
+            state.volume = max(0, min(int(value), VOLUME_MAX_ATTENUATION))
+        elif operation == 'SRC' and value:
+            state.source = max(1, min(int(value), 6))
+        elif operation == 'TREB' and value:
+            state.treble = int(value)
+        elif operation == 'BASS' and value:
+            state.bass = int(value)
+        else:
+            return b'#?'
+        return self.frame(zone)
+
+    def source_name(self, source: int) -> bytes:
+        """
+        :param source: source id
+        :return: source name frame, i.e. Z02STR+"TUNER"
+        """
+        return 'Z0{}STR+"{}"'.format(source, self.source_names[source]).encode()
+
+    def rename(self, source: int, name: str) -> bytes:
+        """
+        Rename a source, as done from the amplifier's setup menu
+        :return: unsolicited source name frame the amplifier sends
+        """
+        self.source_names[source] = name
+        return self.source_name(source)
+
+    def keypad(self, zone: int = None):
+        """
+        Apply a change made on a wall keypad
+        :param zone: zone to change, a random one if None
+        :return: unsolicited status frame the amplifier sends
+        """
+        rng = self.rng
+        zone = zone or rng.choice(list(self.zones))
+        state = self.zones[zone]
+        change = rng.choice(('power', 'volume', 'volume', 'source', 'mute'))
+        if change == 'power' or not state.power:
+            state.power = not state.power
+        elif change == 'volume':
+            state.volume = max(0, min(state.volume + rng.choice((-2, -1, 1, 2)),
+                                      VOLUME_MAX_ATTENUATION))
+        elif change == 'source':
+            state.source = rng.randint(1, 6)
+        else:
+            state.mute = not state.mute
+        return self.frame(zone)
+
+
+class Serial(SerialBase):
+    """
+    Serial port connected to a NuvoEmulator, with the byte timing of a real
+    link at the configured baudrate
+    """
+
+    BAUDRATES = (9600, 19200, 38400, 57600, 115200)
+
+    def __init__(self, *args, **kwargs):
+        self.amplifier = None
+        self._rx = bytearray()
+        self._rx_ready = threading.Condition()
+        self._lines = collections.deque()
+        self._tx = bytearray()
+        self._wakeup = threading.Event()
+        self._device = None
+        self._delay = 0.005
+        self._latency = True
+        self._keypad = 0.0
+        self._drop = 0.0
+        self._backlog = 0
+        super(Serial, self).__init__(*args, **kwargs)
+
+    def open(self):
+        if self.is_open:
+            raise SerialException('Port is already open.')
+        if self._port is None:
+            raise SerialException('Port must be configured before it can be used.')
+        self.from_url(self.port)
+        self._reconfigure_port()
+        self.is_open = True
+        self.reset_input_buffer()
+        self.reset_output_buffer()
+        self._device = threading.Thread(
+            target=self._run_device, name='nuvosim-device', daemon=True)
+        self._device.start()
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            self._wakeup.set()
+            with self._rx_ready:
+                self._rx_ready.notify_all()
+            self._device.join()
+        super(Serial, self).close()
+
+    def _reconfigure_port(self):
+        if not isinstance(self._baudrate, int) or not 0 < self._baudrate < 2 ** 32:
+            raise ValueError('invalid baudrate: {!r}'.format(self._baudrate))
+
+    def from_url(self, url):
+        parts = urlparse.urlsplit(url)
+        if parts.scheme != SCHEME:
+            raise SerialException(
+                'expected a string in the form "{}://[model][?option=value...]": '
+                'not starting with {}:// ({!r})'.format(SCHEME, SCHEME, parts.scheme))
+        model = parts.netloc or 'essentia'
+        zones, busy, seed = 12, 0.0, None
+        try:
+            for option, values in urlparse.parse_qs(parts.query, True).items():
+                value = values[0]
+                if option == 'zones':
+                    zones = int(value)
+                elif option == 'delay':
+                    self._delay = float(value)
+                elif option == 'latency':
+                    self._latency = value not in ('0', 'false', 'no')
+                elif option == 'busy':
+                    busy = float(value)
+                elif option == 'keypad':
+                    self._keypad = float(value)
+                elif option == 'drop':
+                    self._drop = float(value)
+                elif option == 'backlog':
+                    self._backlog = int(value)
+                elif option == 'seed':
+                    seed = int(value)
+                else:
+                    raise ValueError('unknown option: {!r}'.format(option))
+            if not 1 <= zones <= (9 if model == 'concerto' else 20):
+                raise ValueError('zones out of range: {}'.format(zones))
+            self.amplifier = NuvoEmulator(model, zones, busy, random.Random(seed))
+        except ValueError as e:
+            raise SerialException(
+                'expected a string in the form "{}://[model][?option=value...]": {}'.format(SCHEME, e))
+
+    def _wire_time(self, size: int) -> float:
+        # 8N1: a start bit, eight data bits and a stop bit per byte
+        return 10.0 * size / self._baudrate if self._latency else 0.0
+
+    def _run_device(self):
+        """
+        The amplifier side of the link: takes complete command lines, answers
+        each one after its processing delay and the wire time of the reply,
+        and sends keypad changes in between
+        """
+        amplifier = self.amplifier
+        rng = amplifier.rng
+        next_keypad = time.monotonic() + rng.expovariate(self._keypad) if self._keypad else None
+        # The amplifier works through one command at a time
+        busy_until = 0.0
+        while self.is_open:
+            wait = None if next_keypad is None else max(0.0, next_keypad - time.monotonic())
+            if not self._lines:
+                self._wakeup.wait(wait)
+                self._wakeup.clear()
+            if not self.is_open:
+                break
+            if self._lines:
+                received, line, busy = self._lines.popleft()
+                if busy:
+                    # Turned away without being processed
+                    self._transmit(b'#Busy')
+                    continue
+                # The command is only complete once its last byte is on the wire,
+                # and processed once the one before it is done
+                busy_until = max(received + self._wire_time(len(line) + len(EOL)),
+                                 busy_until) + self._delay
+                self._sleep_until(busy_until)
+                self._transmit(amplifier.handle(line))
+            if next_keypad is not None and time.monotonic() >= next_keypad:
+                self._transmit(amplifier.keypad())
+                next_keypad = time.monotonic() + rng.expovariate(self._keypad)
+
+    @staticmethod
+    def _sleep_until(deadline):
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def push(self, frame: bytes):
+        """
+        Send a frame the amplifier produced on its own, i.e. from rename()
+        """
+        self._transmit(frame)
+
+    def _transmit(self, frame):
+        if frame is None:
+            return
+        data = frame + EOL
+        if self._drop:
+            rng = self.amplifier.rng
+            data = bytes(byte for byte in data if rng.random() >= self._drop)
+        self._sleep_until(time.monotonic() + self._wire_time(len(data)))
+        with self._rx_ready:
+            self._rx += data
+            self._rx_ready.notify_all()
+
+    #  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -
+
+    @property
+    def in_waiting(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+        return len(self._rx)
+
+    def read(self, size=1):
+        if not self.is_open:
+            raise PortNotOpenError()
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+        with self._rx_ready:
+            while len(self._rx) < size and self.is_open:
+                if deadline is None:
+                    self._rx_ready.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._rx_ready.wait(remaining)
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+        return data
+
+    def write(self, data):
+        if not self.is_open:
+            raise PortNotOpenError()
+        data = to_bytes(data)
+        now = time.monotonic()
+        self._tx += data
+        while EOL in self._tx:
+            line, _, rest = bytes(self._tx).partition(EOL)
+            self._tx[:] = rest
+            busy = bool(self._backlog) and sum(
+                not queued[2] for queued in self._lines) >= self._backlog
+            self._lines.append((now, line, busy))
+        self._wakeup.set()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+        with self._rx_ready:
+            del self._rx[:]
+
+    def reset_output_buffer(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+        del self._tx[:]
+
+    @property
+    def out_waiting(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+        return len(self._tx)
+
+    def _update_break_state(self):
+        pass
+
+    def _update_rts_state(self):
+        pass
+
+    def _update_dtr_state(self):
+        pass
+
+    @property
+    def cts(self):
+        return True
+
+    @property
+    def dsr(self):
+        return True
+
+    @property
+    def ri(self):
+        return False
+
+    @property
+    def cd(self):
+        return True
+
+
+def register():
+    """
+    Make the nuvosim:// scheme known to serial.serial_for_url
+    """
+    if __package__:
+        if __package__ not in serial.protocol_handler_packages:
+            serial.protocol_handler_packages.append(__package__)
+    else:
+        # Loaded as a top level module, pyserial only looks inside packages
+        sys.modules.setdefault('serial.urlhandler.protocol_' + SCHEME, sys.modules[__name__])
+
+
+register()
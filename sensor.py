@@ -0,0 +1,55 @@
+"""
+Support for the diagnostics of Nuvo multi zone amplifiers, one sensor per
+controller, set up by the media_player platform
+"""
+import datetime
+import logging
+
+from homeassistant.components.sensor import SensorEntity
+from homeassistant.helpers.entity import EntityCategory
+
+try:
+    from .media_player import ATTR_DIAGNOSTICS, DATA_NUVO_CONTROLLERS
+except ImportError:
+    from media_player import ATTR_DIAGNOSTICS, DATA_NUVO_CONTROLLERS
+
+_LOGGER = logging.getLogger(__name__)
+
+SCAN_INTERVAL = datetime.timedelta(seconds=60)
+
+
+def setup_platform(hass, config, add_entities, discovery_info=None):
+    """Set up a diagnostics sensor for every Nuvo controller."""
+    if discovery_info is None:
+        return
+    add_entities([NuvoDiagnostics(port, coordinator) for port, coordinator
+                  in hass.data.get(DATA_NUVO_CONTROLLERS, {}).items()])
+
+
+class NuvoDiagnostics(SensorEntity):
+    """Transport and polling diagnostics of a Nuvo controller."""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    # The metrics change on every update, the recorder keeps only the link state
+    _unrecorded_attributes = frozenset({ATTR_DIAGNOSTICS})
+
+    def __init__(self, port, coordinator):
+        """Initialize the sensor."""
+        self._port = port
+        self._coordinator = coordinator
+
+    @property
+    def name(self):
+        """Return the name of the sensor."""
+        return 'Nuvo {} diagnostics'.format(self._port)
+
+    @property
+    def native_value(self):
+        """Return the state of the serial link."""
+        return 'up' if self._coordinator.nuvo.link_up else 'down'
+
+    @property
+    def extra_state_attributes(self):
+        """Return transport and polling diagnostics of the controller."""
+        return {ATTR_DIAGNOSTICS: dict(self._coordinator.nuvo.metrics.as_dict(),
+                                       polling=self._coordinator.schedule())}
@@ -0,0 +1,428 @@
+"""
+Regression tests for the Nuvo protocol library, driven through the
+nuvosim:// emulator
+
+    python -m pytest -q test_media_player.py
+"""
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+import serial
+
+pytest.importorskip('homeassistant')
+# Loads the Home Assistant components in an order media_player can import from
+import homeassistant.bootstrap  # noqa: F401
+
+try:
+    from . import media_player as mp
+    from . import protocol_nuvosim  # noqa: F401
+except ImportError:
+    import media_player as mp
+    import protocol_nuvosim  # noqa: F401
+
+
+@pytest.fixture
+def nuvo():
+    """Sync interface to an emulated four zone Essentia"""
+    nuvo = mp.get_nuvo('nuvosim://essentia?zones=4&seed=1', cache_ttl=0)
+    yield nuvo
+    nuvo.close()
+
+
+@pytest.fixture
+def socket_url():
+    """socket:// URL of a TCP bridge to an emulated Essentia with keypad traffic"""
+    server = socket.create_server(('127.0.0.1', 0))
+    amplifier = serial.serial_for_url('nuvosim://essentia?zones=4&keypad=20&seed=1',
+                                      timeout=0.05)
+
+    def upstream(conn):
+        try:
+            for data in iter(lambda: conn.recv(1024), b''):
+                amplifier.write(data)
+        except (OSError, serial.SerialException):
+            pass
+
+    def downstream():
+        try:
+            conn, _ = server.accept()
+            threading.Thread(target=upstream, args=(conn,), daemon=True).start()
+            while True:
+                data = amplifier.read(amplifier.in_waiting or 1)
+                if data:
+                    conn.sendall(data)
+        except (OSError, serial.SerialException):
+            pass
+
+    threading.Thread(target=downstream, daemon=True).start()
+    yield 'socket://127.0.0.1:{}'.format(server.getsockname()[1])
+    server.close()
+    amplifier.close()
+
+
+def test_async_transport(socket_url):
+    async def exercise():
+        nuvo = await mp.get_nuvo_async(socket_url, model='essentia', cache_ttl=0)
+        pushed = []
+        nuvo.add_status_listener(pushed.append)
+        try:
+            assert (await nuvo.set_power(2, True)).zone == 2
+            assert (await nuvo.set_volume(2, -50)).zone == 2
+            # Keypad changes of other zones arrive between commands and
+            # answers, each reply still belongs to the zone asked
+            for _ in range(10):
+                statuses = await nuvo.zone_statuses([1, 3, 4])
+                assert all(statuses[zone].zone == zone for zone in (1, 3, 4))
+            assert pushed
+        finally:
+            await nuvo.close()
+
+    asyncio.run(exercise())
+
+
+def test_parse_essentia_frames():
+    status = mp.parse_frame(b'#Z1,ON,SRC3,VOL39,DND0,LOCK0')
+    assert (status.zone, status.power, status.source, status.volume, status.mute) == \
+        (1, True, '3', 50.0, False)
+    assert mp.parse_frame(b'#Z12,OFF').power is False
+    assert mp.parse_frame(b'#Z7,ON,SRC1,VOLMUTE,DND0,LOCK1').mute is True
+    assert mp.parse_frame(b'#Busy') is mp.BUSY_REPLY
+    assert mp.parse_frame(b'#ALLOFF') is mp.ALL_ZONES_REPLY
+    assert mp.parse_frame(b'#?') is None
+    # Frames that lost bytes on the wire are rejected, not read as a muted zone
+    assert mp.parse_frame(b'#Z1,ON,SRC1,VOL4') is None
+    assert mp.parse_frame(b'#Z1,ON,SRC1,VOL40,DND0,LOC') is None
+    assert mp.parse_frame(b'#Z1,ON') is None
+
+
+def test_parse_concerto_frames():
+    status = mp.parse_frame(b'Z02PWRON,SRC2,VOL-39')
+    assert (status.zone, status.power, status.source, status.volume) == (2, True, '2', 50.0)
+    assert mp.parse_frame(b'Z02STR+"TUNER"') == mp.SourceName(2, 'TUNER')
+    assert mp.parse_frame(b'Z02PWRON,SRC2,VOL-3') is None
+    assert mp.parse_frame(b'#Z02PWRON,SRC2,VOL-39X') is None
+
+
+def test_status_cache_expires_and_invalidates():
+    cache = mp.StatusCache(ttl=0.1)
+    status = mp.ZoneStatus(1, 'ON', 2, 50.0)
+    cache.put(status)
+    cache.put(mp.ZoneStatus(2, 'OFF', None, None))
+    assert cache.get(1) is status
+    time.sleep(0.15)
+    assert cache.get(1) is None
+    cache.put(status)
+    cache.invalidate(1)
+    assert cache.get(1) is None
+    cache.put(status)
+    cache.invalidate()
+    assert cache.get(1) is None and cache.get(2) is None
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_command_reply_refreshes_cached_status():
+    nuvo = mp.get_nuvo('nuvosim://essentia?zones=4&seed=1', cache_ttl=60)
+    try:
+        nuvo.set_power(1, True)
+        nuvo.set_source(1, 2)
+        assert nuvo.zone_status(1).source == '2'
+        nuvo.set_source(1, 3)
+        # Served from the cache, filled by the reply to the command
+        misses = nuvo.status_cache.misses
+        assert nuvo.zone_status(1).source == '3'
+        assert nuvo.status_cache.misses == misses
+    finally:
+        nuvo.close()
+
+
+def test_line_framer_joins_chunks():
+    framer = mp.LineFramer()
+    framer.feed(b'#Z1,OF')
+    assert framer.pop() is None
+    framer.feed(b'F\r#Busy\r#Z2')
+    assert framer.pop() == b'#Z1,OFF'
+    assert framer.pop() == b'#Busy'
+    assert framer.pop() is None
+    framer.feed(b',OFF\r')
+    assert framer.pop() == b'#Z2,OFF'
+
+
+def test_coalescer_sends_first_and_latest():
+    coalescer = mp.LatestWinsCoalescer()
+    sent = []
+    release = threading.Event()
+
+    def send(value):
+        sent.append(value)
+        if value == 1:
+            release.wait(1)
+        return value
+
+    results = {}
+
+    def submit(value):
+        results[value] = coalescer.submit('volume', value, send)
+
+    first = threading.Thread(target=submit, args=(1,))
+    first.start()
+    time.sleep(0.05)
+    later = [threading.Thread(target=submit, args=(value,)) for value in (2, 3, 4)]
+    for thread in later:
+        thread.start()
+        time.sleep(0.01)
+    release.set()
+    for thread in [first] + later:
+        thread.join()
+    assert sent == [1, 4]
+    # The first caller keeps sending until the latest value is on the wire
+    assert results == {1: 4, 2: 4, 3: 4, 4: 4}
+
+
+def test_priority_lock_serves_interactive_before_poll():
+    lock = mp.PriorityLock(aging=60)
+    order = []
+
+    def worker(priority, name):
+        lock.acquire(priority)
+        order.append(name)
+        lock.release()
+
+    lock.acquire(mp.PRIORITY_INTERACTIVE)
+    poll = threading.Thread(target=worker, args=(mp.PRIORITY_POLL, 'poll'))
+    poll.start()
+    time.sleep(0.05)
+    user = threading.Thread(target=worker, args=(mp.PRIORITY_INTERACTIVE, 'user'))
+    user.start()
+    time.sleep(0.05)
+    lock.release()
+    poll.join()
+    user.join()
+    assert order == ['user', 'poll']
+
+
+def test_pacer_cuts_on_busy_and_recovers():
+    pacer = mp.CommandPacer(rate=100.0, burst=2)
+    pacer.record(mp.BUSY_REPLY)
+    assert (pacer.rate, pacer.cuts) == (50.0, 1)
+    assert pacer.gap >= mp.PACER_GAP_STEP
+    # Nothing goes out before the bucket refills
+    assert pacer.delay() > 0
+    # Replies to the commands already in flight don't cut again
+    pacer.record(None)
+    assert (pacer.rate, pacer.cuts) == (50.0, 1)
+    status = mp.ZoneStatus(1, 'ON', 1, 50.0)
+    for _ in range(200):
+        pacer.record(status)
+    assert (pacer.rate, pacer.gap) == (100.0, 0.0)
+
+
+def test_silent_zone_does_not_slow_the_pacer():
+    # Zone 5 is not installed, the zones after it answer
+    nuvo = mp.get_nuvo('nuvosim://essentia?zones=4&seed=1', cache_ttl=0)
+    try:
+        statuses = nuvo.zone_statuses([5, 1, 2, 3], timeout=2.0)
+        assert statuses[5] is None
+        assert all(statuses[zone] is not None for zone in (1, 2, 3))
+        assert nuvo.pacer.cuts == 0
+        assert nuvo.pacer.rate == nuvo.pacer.max_rate
+    finally:
+        nuvo.close()
+
+
+def test_restore_requests_send_only_changes():
+    target = mp.ZoneStatus(3, 'ON', 2, 50.0)
+    assert mp._restore_requests(target, target) == []
+    requests = mp._restore_requests(target, mp.ZoneStatus(3, 'ON', 5, 50.0))
+    assert requests == [(3, mp._format_set_source(3, 2))]
+    # A zone restored to off needs nothing but the power command
+    requests = mp._restore_requests(mp.ZoneStatus(3, 'OFF', None, None), target)
+    assert requests == [(3, mp._format_set_power(3, False))]
+
+
+def test_volume_is_sent_in_whole_db(nuvo):
+    assert mp._format_set_volume(1, 0.05) == 'Z1VOL04'
+    nuvo.set_power(1, True)
+    status = nuvo.set_volume(1, -50)
+    assert status is not None and status.volume == 50.0
+
+
+def test_restore_zone_round_trip(nuvo):
+    nuvo.set_power(2, True)
+    nuvo.set_source(2, 4)
+    saved = nuvo.set_volume(2, -25)
+    nuvo.set_source(2, 1)
+    nuvo.set_volume(2, -70)
+    assert not nuvo.restore_zone(saved).diff(saved)
+
+
+def test_restore_zones_resends_busy_commands():
+    # A one command backlog answers #Busy to most pipelined commands
+    nuvo = mp.get_nuvo('nuvosim://essentia?zones=8&backlog=1&seed=1', cache_ttl=0)
+    try:
+        saved = []
+        for zone in range(1, 9):
+            nuvo.set_power(zone, True)
+            nuvo.set_source(zone, zone % 6 + 1)
+            saved.append(nuvo.set_volume(zone, -6 * zone))
+        for zone in range(1, 9):
+            nuvo.set_power(zone, False)
+        restored = nuvo.restore_zones(saved)
+        for status in saved:
+            assert restored[status.zone] is not None
+            assert not nuvo.zone_status(status.zone).diff(status)
+    finally:
+        nuvo.close()
+
+
+def test_group_source_resends_busy_commands():
+    nuvo = mp.get_nuvo('nuvosim://essentia?zones=8&backlog=1&seed=1', cache_ttl=0)
+    try:
+        for zone in range(1, 9):
+            nuvo.set_power(zone, True)
+        statuses = nuvo.set_group_source(range(1, 9), 5)
+        assert all(status is not None and status.source == '5'
+                   for status in statuses.values())
+        assert all(nuvo.zone_status(zone).source == '5' for zone in range(1, 9))
+    finally:
+        nuvo.close()
+
+
+def test_source_names_are_time_boxed():
+    # Each name request takes the amplifier a second to answer
+    nuvo = mp.get_nuvo('nuvosim://concerto?zones=4&delay=1', model='concerto')
+    try:
+        start = time.monotonic()
+        names = nuvo.source_names(range(1, 7), timeout=1.5)
+        assert time.monotonic() - start < 2.5
+        assert len(names) < 6
+    finally:
+        nuvo.close()
+
+
+def _zone_entity(nuvo, zone_id=1):
+    """Zone entity on its own coordinator, without Home Assistant running"""
+    coordinator = mp.NuvoStatusCoordinator(nuvo, [zone_id])
+    catalog = mp.NuvoSourceCatalog(None, None, {}, nuvo, 'nuvosim', {1: 'CD', 2: 'Radio'})
+    zone = mp.NuvoZone(nuvo, coordinator, catalog, zone_id, 'Kitchen')
+    zone.schedule_update_ha_state = lambda force_refresh=False: None
+    coordinator.add_listener(zone_id, zone._handle_coordinator_update)
+    coordinator.refresh()
+    return zone
+
+
+def test_zone_confirms_and_rolls_back_commands(nuvo, monkeypatch):
+    nuvo.set_power(1, True)
+    nuvo.set_source(1, 1)
+    zone = _zone_entity(nuvo)
+    assert zone.source == 'CD'
+    zone.select_source('Radio')
+    assert zone.source == 'Radio'
+    assert not zone._pending
+    # An unanswered command falls back to the last status the zone reported
+    monkeypatch.setattr(nuvo, 'set_source', lambda zone_id, source: None)
+    shown = []
+    monkeypatch.setattr(zone, 'schedule_update_ha_state',
+                        lambda force_refresh=False: shown.append(zone.source))
+    zone.select_source('CD')
+    assert shown == ['CD', 'Radio']
+    assert zone.source == 'Radio'
+    assert not zone._pending
+
+
+def test_zone_keeps_volume_while_muted_or_off(nuvo):
+    nuvo.set_power(1, True)
+    nuvo.set_volume(1, -50)
+    zone = _zone_entity(nuvo)
+    assert zone.volume_level == pytest.approx(0.5, abs=0.01)
+    zone.mute_volume(True)
+    assert zone.is_volume_muted
+    assert zone.volume_level == pytest.approx(0.5, abs=0.01)
+    # One step up from the volume the zone had, not from the muted 0
+    zone.volume_up()
+    nuvo.set_mute(1, False)
+    assert nuvo.zone_status(1).volume == pytest.approx(50 + mp.VOLUME_STEP, abs=1)
+    zone.turn_off()
+    assert zone.volume_level == pytest.approx(0.5 + mp.VOLUME_STEP / 100, abs=0.01)
+
+
+def test_coordinator_polls_on_activity_schedule():
+    nuvo = mp.get_nuvo('nuvosim://essentia?zones=4&seed=1', cache_ttl=60)
+    try:
+        nuvo.set_power(1, True)
+        nuvo.set_power(2, False)
+        nuvo.status_cache.invalidate(2)
+        coordinator = mp.NuvoStatusCoordinator(nuvo, [1, 2])
+        cache = nuvo.status_cache
+        hits, misses = cache.hits, cache.misses
+        coordinator.refresh()
+        # Every zone is looked up in the cache once, only the miss is polled
+        assert (cache.hits - hits, cache.misses - misses) == (1, 1)
+        zones = coordinator.schedule()['zones']
+        assert (zones[1]['polls'], zones[2]['polls']) == (0, 1)
+        assert zones[1]['interval_s'] == mp.POLL_IDLE_INTERVAL
+        assert zones[2]['interval_s'] == mp.POLL_OFF_INTERVAL
+        coordinator.mark_active(2)
+        zones = coordinator.schedule()['zones']
+        assert zones[2]['interval_s'] == mp.POLL_ACTIVE_INTERVAL
+        assert zones[2]['due_in_s'] <= mp.POLL_ACTIVE_INTERVAL
+        # Nothing is due yet, the tick sends nothing
+        coordinator.poll()
+        assert coordinator.schedule()['zones'][2]['polls'] == 1
+    finally:
+        nuvo.close()
+
+
+def test_link_reconnects_after_port_loss(nuvo):
+    assert nuvo.zone_status(1) is not None
+    # The adapter vanishes: the next read fails and the reader reopens the port
+    nuvo._port.close()
+    _wait_for_reconnect(nuvo)
+    assert nuvo.link_up
+    assert nuvo.metrics.link_downs == 1
+    assert nuvo.zone_status(2) is not None
+
+
+def _wait_for_reconnect(nuvo, timeout=5):
+    deadline = time.monotonic() + timeout
+    while nuvo.metrics.link_downs == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    while not nuvo.link_up and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def test_link_reconnects_after_read_os_error(nuvo, monkeypatch):
+    # A USB-serial adapter reset fails the in_waiting ioctl with EIO
+    port_type = type(nuvo._port)
+    failures = [OSError(5, 'Input/output error')]
+
+    def in_waiting(port):
+        if failures:
+            raise failures.pop()
+        return len(port._rx)
+
+    monkeypatch.setattr(port_type, 'in_waiting', property(in_waiting))
+    _wait_for_reconnect(nuvo)
+    assert nuvo._reader.is_alive()
+    assert nuvo.link_up
+    assert nuvo.metrics.link_downs == 1
+    assert nuvo.zone_status(2) is not None
+
+
+def test_write_os_error_takes_link_down(nuvo, monkeypatch):
+    port_type = type(nuvo._port)
+    failures = [OSError(5, 'Input/output error')]
+
+    def flush(port):
+        if failures:
+            raise failures.pop()
+
+    monkeypatch.setattr(port_type, 'flush', flush)
+    assert nuvo.set_power(1, True) is None
+    # The request that failed to go out no longer waits for a frame
+    assert not nuvo._waiters
+    _wait_for_reconnect(nuvo)
+    assert nuvo.link_up
+    assert nuvo.set_power(1, True).power is True